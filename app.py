@@ -1,5 +1,23 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+from queue import Empty, Queue
+
 import streamlit as st
-from utils import generate_design_idea, fetch_image_from_lexica, generate_stability_image, validate_inputs
+from blobstore import blob_store, is_blob_ref
+from config import STREAM_DESIGN_PLANS
+from metrics import start_metrics_server
+from normalize import log_request
+from plan import plan_markdown
+from profiling import finish_rerun, lap, start_rerun
+from utils import FORM_DEFAULTS, generate_design_idea, plan_generator, stream_design_idea, fetch_image_from_lexica, generate_stability_image, get_gallery_page, submit_background, validate_inputs, warm_model_clients
+from variants import VARIED_FIELDS, start_variants, variant_specs
+
+# Per-rerun phase timings (PROFILING_ENABLED only)
+rerun_profile = start_rerun()
+
+# Warm the shared Gemini clients once per process, off the session thread
+submit_background(warm_model_clients)
+# Prometheus metrics for this process (no-op after the first run)
+start_metrics_server()
 
 # Page configuration
 st.set_page_config(
@@ -266,6 +284,7 @@ st.markdown("""
     }
 </style>
 """, unsafe_allow_html=True)
+lap("page setup and CSS")
 
 def display_error(message):
     """Display error message with custom styling"""
@@ -291,12 +310,163 @@ def display_info(message):
     </div>
     """, unsafe_allow_html=True)
 
+def render_image(image_url, style):
+    """Display the design inspiration image"""
+    st.markdown("## 🖼️ Design Inspiration")
+    if is_blob_ref(image_url):
+        # Stored images are served as media files, so reruns don't resend the bytes
+        image_bytes = blob_store.get(image_url)
+        if image_bytes is None:
+            display_info("No image available at this time.")
+        else:
+            st.image(image_bytes, caption=f"{style} Home Design Inspiration", use_container_width=True)
+        return
+    st.markdown(f"""
+    <div class="image-container">
+        <img src="{image_url}" alt="{style} Home Design Inspiration">
+    </div>
+    """, unsafe_allow_html=True)
+
+def change_gallery_page(step):
+    """Move the inspiration gallery by step pages"""
+    st.session_state.gallery_page = max(0, st.session_state.gallery_page + step)
+
+def render_inspiration_gallery(style):
+    """Page through the cached Lexica results for a style without new Lexica requests"""
+    items, page_count = get_gallery_page(style, st.session_state.gallery_page)
+    if not items:
+        return
+    page = min(st.session_state.gallery_page, page_count - 1)
+
+    st.markdown("### 🎨 More Inspiration")
+    for col, item in zip(st.columns(len(items)), items):
+        with col:
+            image_bytes = blob_store.get(item["thumbnail_ref"]) if item["thumbnail_ref"] else None
+            if image_bytes:
+                # A broken thumbnail must not take the download button down with the fragment
+                try:
+                    st.image(image_bytes, use_container_width=True)
+                except Exception as e:
+                    st.caption(f"Preview unavailable: {str(e)}")
+            st.markdown(f"[View full image]({item['src']})")
+
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        st.button("⬅️ Previous", key="gallery_prev", disabled=page == 0,
+                  on_click=change_gallery_page, args=(-1,))
+    with page_col:
+        st.markdown(f"<p style='text-align: center;'>Page {page + 1} of {page_count}</p>", unsafe_allow_html=True)
+    with next_col:
+        st.button("Next ➡️", key="gallery_next", disabled=page >= page_count - 1,
+                  on_click=change_gallery_page, args=(1,))
+
+@st.fragment
+def render_results(style):
+    """Show the finished plan, image, gallery and download button; gallery paging reruns only this fragment"""
+    st.markdown('<div class="section">', unsafe_allow_html=True)
+
+    # Structured plans are kept as records and only rendered here
+    plan_text = plan_markdown(st.session_state.design_idea)
+    col1, col2 = st.columns([2, 1])
+
+    with col1:
+        st.markdown("## 📋 Your Custom Home Design Plan")
+        st.markdown(plan_text)
+
+    with col2:
+        if st.session_state.image_url:
+            render_image(st.session_state.image_url, style)
+        else:
+            display_info("No image available at this time.")
+
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    if st.session_state.gallery_style:
+        render_inspiration_gallery(st.session_state.gallery_style)
+
+    # Download option
+    st.markdown("---")
+    st.markdown("### 💾 Save Your Design")
+    st.download_button(
+        label="📄 Download Design Plan as Text",
+        data=plan_text,
+        file_name=f"{style.lower().replace(' ', '_')}_home_design.txt",
+        mime="text/plain"
+    )
+
+def run_variants(specs, image_source):
+    """Generate every variant's plan and image concurrently, reporting progress as they finish"""
+    display_info(f"🔀 Creating {len(specs)} design variants side by side...")
+    for spec in specs:
+        log_request(**{key: value for key, value in spec.items() if key != "label"})
+    started = start_variants(specs, plan_generator(), "stability" if image_source == "AI Image Generation" else "lexica")
+    progress = st.progress(0.0, text="Generating variants...")
+    pending = {future for pair in started for future in pair if future is not None}
+    while pending:
+        _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        ready = sum(plan_future.done() and (image_future is None or image_future.done())
+                    for plan_future, image_future in started)
+        progress.progress(ready / len(started), text=f"{ready} of {len(started)} variants ready")
+    progress.empty()
+
+    variants = []
+    for spec, (plan_future, image_future) in zip(specs, started):
+        variant = {"label": spec["label"], "style": spec["style"], "plan": None, "image_url": None}
+        try:
+            variant["plan"] = plan_future.result()
+        except Exception as e:
+            display_error(f"Error generating the {spec['label']} design plan: {str(e)}")
+        try:
+            variant["image_url"] = image_future.result() if image_future is not None else None
+        except Exception as e:
+            display_error(f"Error with the {spec['label']} image: {str(e)}")
+        variants.append(variant)
+    st.session_state.variants = variants
+    st.session_state.design_idea = None
+    if any(variant["plan"] for variant in variants):
+        display_success(f"✅ {len(variants)} design variants generated!")
+    else:
+        display_error("⚠️ Could not generate the design variants. Please try again.")
+
+def render_variants(variants):
+    """Show the variant plans and images side by side, each with its own download button"""
+    st.markdown('<div class="section">', unsafe_allow_html=True)
+    st.markdown("## 🔀 Compare Your Design Variants")
+    for index, (column, variant) in enumerate(zip(st.columns(len(variants)), variants)):
+        with column:
+            st.markdown(f"### {variant['label']}")
+            if variant["image_url"]:
+                render_image(variant["image_url"], variant["style"])
+            else:
+                display_info("No image available at this time.")
+            plan_text = plan_markdown(variant["plan"]) if variant["plan"] else None
+            if plan_text:
+                st.markdown(plan_text)
+                st.download_button(
+                    label="📄 Download Plan",
+                    data=plan_text,
+                    file_name=f"{variant['label'].lower().replace(' ', '_')}_home_design.txt",
+                    mime="text/plain",
+                    key=f"variant_download_{index}"
+                )
+            else:
+                display_error("⚠️ Could not generate this design plan.")
+    st.markdown('</div>', unsafe_allow_html=True)
+
 def main():
     # Initialize session state variables if they don't exist
     if 'design_idea' not in st.session_state:
         st.session_state.design_idea = None
     if 'image_url' not in st.session_state:
         st.session_state.image_url = None
+    if 'design_style' not in st.session_state:
+        st.session_state.design_style = None
+    if 'gallery_style' not in st.session_state:
+        st.session_state.gallery_style = None
+    if 'gallery_page' not in st.session_state:
+        st.session_state.gallery_page = 0
+    if 'variants' not in st.session_state:
+        st.session_state.variants = None
 
     # Main container with animation
     st.markdown('<div class="main-container">', unsafe_allow_html=True)
@@ -304,6 +474,7 @@ def main():
     # Application header
     st.markdown('<h1 class="main-header">🏠 Custom Home Design Assistant</h1>', unsafe_allow_html=True)
     st.markdown('<p class="sub-header">Create your dream home with AI-powered design recommendations</p>', unsafe_allow_html=True)
+    lap("header")
     
     # Sidebar for additional information
     with st.sidebar:
@@ -334,286 +505,450 @@ def main():
         - Consider both indoor and outdoor needs
         - Think about your lifestyle requirements
         """)
+    lap("sidebar")
     
-    # Main input section
-    st.markdown('<div class="section">', unsafe_allow_html=True)
-
-    # Add a decorative header for the input section
-    st.markdown("""
-    <div style="text-align: center; margin-bottom: 2rem;">
-        <h2 style="color: #3498db; font-size: 1.8rem; margin-bottom: 0.5rem;">✨ Start Your Design Journey</h2>
-        <p style="color: #7f8c8d; font-size: 1.1rem;">Fill in the details below to create your dream home</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-    # Create a grid for the main inputs
-    col1, col2, col3 = st.columns(3)
+    # Inputs are batched in a form: editing them does not rerun the script until Generate is pressed
+    with st.form("design_form", border=False):
+        # Main input section
+        st.markdown('<div class="section">', unsafe_allow_html=True)
 
-    with col1:
+        # Add a decorative header for the input section
         st.markdown("""
-        <div style="text-align: center; margin-bottom: 0.5rem;">
-            <span style="font-size: 1.2rem;">🎨</span>
+        <div style="text-align: center; margin-bottom: 2rem;">
+            <h2 style="color: #3498db; font-size: 1.8rem; margin-bottom: 0.5rem;">✨ Start Your Design Journey</h2>
+            <p style="color: #7f8c8d; font-size: 1.1rem;">Fill in the details below to create your dream home</p>
         </div>
         """, unsafe_allow_html=True)
-        style = st.text_input(
-            "Design Style",
-            placeholder="e.g., Modern, Rustic, Contemporary",
-            help="Enter your preferred architectural and interior design style",
-            key="design_style_input"
-        )
 
-    with col2:
-        st.markdown("""
-        <div style="text-align: center; margin-bottom: 0.5rem;">
-            <span style="font-size: 1.2rem;">📏</span>
-        </div>
-        """, unsafe_allow_html=True)
-        size = st.text_input(
-            "Home Size",
-            placeholder="e.g., 2000 sq ft, Large, Medium",
-            help="Specify the size of your home in square feet or general terms",
-            key="home_size_input"
-        )
+        # Create a grid for the main inputs
+        col1, col2, col3 = st.columns(3)
+
+        with col1:
+            st.markdown("""
+            <div style="text-align: center; margin-bottom: 0.5rem;">
+                <span style="font-size: 1.2rem;">🎨</span>
+            </div>
+            """, unsafe_allow_html=True)
+            style = st.text_input(
+                "Design Style",
+                placeholder="e.g., Modern, Rustic, Contemporary",
+                help="Enter your preferred architectural and interior design style",
+                key="design_style_input"
+            )
 
-    with col3:
+        with col2:
+            st.markdown("""
+            <div style="text-align: center; margin-bottom: 0.5rem;">
+                <span style="font-size: 1.2rem;">📏</span>
+            </div>
+            """, unsafe_allow_html=True)
+            size = st.text_input(
+                "Home Size",
+                placeholder="e.g., 2000 sq ft, Large, Medium",
+                help="Specify the size of your home in square feet or general terms",
+                key="home_size_input"
+            )
+
+        with col3:
+            st.markdown("""
+            <div style="text-align: center; margin-bottom: 0.5rem;">
+                <span style="font-size: 1.2rem;">🏠</span>
+            </div>
+            """, unsafe_allow_html=True)
+            rooms = st.text_input(
+                "Number of Rooms",
+                placeholder="e.g., 4, 5, 6",
+                help="Enter the total number of rooms you want",
+                key="rooms_input"
+            )
+
+        # Add a decorative separator
         st.markdown("""
-        <div style="text-align: center; margin-bottom: 0.5rem;">
-            <span style="font-size: 1.2rem;">🏠</span>
+        <div style="text-align: center; margin: 2rem 0;">
+            <div style="height: 1px; background: linear-gradient(to right, transparent, #3498db, transparent);"></div>
         </div>
         """, unsafe_allow_html=True)
-        rooms = st.text_input(
-            "Number of Rooms",
-            placeholder="e.g., 4, 5, 6",
-            help="Enter the total number of rooms you want",
-            key="rooms_input"
-        )
 
-    # Add a decorative separator
-    st.markdown("""
-    <div style="text-align: center; margin: 2rem 0;">
-        <div style="height: 1px; background: linear-gradient(to right, transparent, #3498db, transparent);"></div>
-    </div>
-    """, unsafe_allow_html=True)
-
-    st.markdown('</div>', unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
     
-    # Additional preferences section
-    st.markdown('<div class="section">', unsafe_allow_html=True)
-    st.markdown("### 🔧 Additional Preferences")
-    col1, col2 = st.columns(2)
+        # Additional preferences section
+        st.markdown('<div class="section">', unsafe_allow_html=True)
+        st.markdown("### 🔧 Additional Preferences")
+        col1, col2 = st.columns(2)
     
-    with col1:
-        budget_range = st.selectbox(
-            "💰 Budget Range",
-            ["Not specified", "Budget-friendly", "Mid-range", "Luxury", "Ultra-luxury"]
-        )
+        with col1:
+            budget_range = st.selectbox(
+                "💰 Budget Range",
+                ["Not specified", "Budget-friendly", "Mid-range", "Luxury", "Ultra-luxury"]
+            )
         
-        outdoor_space = st.selectbox(
-            "🌿 Outdoor Space",
-            ["Not specified", "Small patio", "Large deck", "Garden", "Pool area", "Extensive landscaping"]
-        )
+            outdoor_space = st.selectbox(
+                "🌿 Outdoor Space",
+                ["Not specified", "Small patio", "Large deck", "Garden", "Pool area", "Extensive landscaping"]
+            )
     
-    with col2:
-        special_features = st.multiselect(
-            "✨ Special Features",
-            ["Home office", "Gym", "Library", "Wine cellar", "Home theater", "Guest suite", "Walk-in closet"]
-        )
+        with col2:
+            special_features = st.multiselect(
+                "✨ Special Features",
+                ["Home office", "Gym", "Library", "Wine cellar", "Home theater", "Guest suite", "Walk-in closet"]
+            )
         
-        eco_friendly = st.checkbox("🌱 Eco-friendly design considerations")
+            eco_friendly = st.checkbox("🌱 Eco-friendly design considerations")
     
-    st.markdown("---")
-    st.subheader("🖼️ Image Source")
-    image_source = st.radio(
-        "Choose how to get design inspiration images:",
-        ("AI Image Generation", "Lexica.art (Image Search)"),
-        index=0,
-        help="Select whether to generate new images or search existing ones."
-    )
+        st.markdown("---")
+        st.subheader("🖼️ Image Source")
+        image_source = st.radio(
+            "Choose how to get design inspiration images:",
+            ("AI Image Generation", "Lexica.art (Image Search)"),
+            index=0,
+            help="Select whether to generate new images or search existing ones."
+        )
     
-    st.info("💡 Tip: AI Image Generation creates unique, custom designs based on your preferences. This may take a few moments but will provide more personalized results.")
-    st.markdown('</div>', unsafe_allow_html=True)
+        st.info("💡 Tip: AI Image Generation creates unique, custom designs based on your preferences. This may take a few moments but will provide more personalized results.")
+        st.markdown('</div>', unsafe_allow_html=True)
 
-    # Detailed Home Planning section
-    with st.expander("📝 Detailed Home Planning (Optional)"):
-        st.markdown('<div class="section">', unsafe_allow_html=True)
-        # Room Configuration
-        st.subheader("Room Configuration")
-        col1, col2 = st.columns(2)
+        # Detailed Home Planning section
+        with st.expander("📝 Detailed Home Planning (Optional)"):
+            st.markdown('<div class="section">', unsafe_allow_html=True)
+            # Room Configuration
+            st.subheader("Room Configuration")
+            col1, col2 = st.columns(2)
         
-        with col1:
-            num_bedrooms = st.number_input("Number of Bedrooms", min_value=1, max_value=10, value=3)
-            num_bathrooms = st.number_input("Number of Bathrooms", min_value=1, max_value=8, value=2)
-            num_doors = st.number_input("Number of Exterior Doors", min_value=1, max_value=10, value=2)
+            with col1:
+                num_bedrooms = st.number_input("Number of Bedrooms", min_value=1, max_value=10,
+                    value=FORM_DEFAULTS["num_bedrooms"])
+                num_bathrooms = st.number_input("Number of Bathrooms", min_value=1, max_value=8,
+                    value=FORM_DEFAULTS["num_bathrooms"])
+                num_doors = st.number_input("Number of Exterior Doors", min_value=1, max_value=10,
+                    value=FORM_DEFAULTS["num_doors"])
             
-        with col2:
-            num_windows = st.number_input("Number of Windows", min_value=1, max_value=30, value=8)
-            ceiling_height = st.selectbox("Ceiling Height", 
-                ["Standard (8ft)", "High (9ft)", "Very High (10ft+)", "Vaulted", "Custom"])
-            floor_material = st.selectbox("Preferred Floor Material",
-                ["Hardwood", "Tile", "Carpet", "Concrete", "Mixed", "Other"])
-
-        # Room Details using tabs instead of expanders
-        st.subheader("Room Details")
-        room_details = {}
+            with col2:
+                num_windows = st.number_input("Number of Windows", min_value=1, max_value=30,
+                    value=FORM_DEFAULTS["num_windows"])
+                ceiling_heights = ["Standard (8ft)", "High (9ft)", "Very High (10ft+)", "Vaulted", "Custom"]
+                ceiling_height = st.selectbox("Ceiling Height", ceiling_heights,
+                    index=ceiling_heights.index(FORM_DEFAULTS["ceiling_height"]))
+                floor_materials = ["Hardwood", "Tile", "Carpet", "Concrete", "Mixed", "Other"]
+                floor_material = st.selectbox("Preferred Floor Material", floor_materials,
+                    index=floor_materials.index(FORM_DEFAULTS["floor_material"]))
+
+            # Room Details using tabs instead of expanders
+            st.subheader("Room Details")
+            room_details = {}
         
-        # Create tabs for different rooms
-        room_tabs = st.tabs(["Living Room", "Kitchen", "Master Bedroom"])
+            # Create tabs for different rooms
+            room_tabs = st.tabs(["Living Room", "Kitchen", "Master Bedroom"])
         
-        # Living Room Tab
-        with room_tabs[0]:
-            col1, col2 = st.columns(2)
-            with col1:
-                room_details["living_room"] = {
-                    "size": st.text_input("Size (sq ft)", key="living_size", 
-                        help="Enter the desired size in square feet"),
-                    "layout": st.selectbox("Preferred Layout", 
-                        ["Open", "Traditional", "Modern", "Minimalist"], key="living_layout"),
-                    "features": st.multiselect("Special Features",
-                        ["Fireplace", "Entertainment Center", "Reading Nook", "Bar Area"], key="living_features")
-                }
-
-        # Kitchen Tab
-        with room_tabs[1]:
-            col1, col2 = st.columns(2)
-            with col1:
-                room_details["kitchen"] = {
-                    "size": st.text_input("Size (sq ft)", key="kitchen_size",
-                        help="Enter the desired size in square feet"),
-                    "layout": st.selectbox("Preferred Layout",
-                        ["Open", "Galley", "L-shaped", "U-shaped", "Island"], key="kitchen_layout"),
-                    "features": st.multiselect("Special Features",
-                        ["Island", "Breakfast Bar", "Walk-in Pantry", "Wine Storage"], key="kitchen_features")
-                }
-
-        # Master Bedroom Tab
-        with room_tabs[2]:
+            # Living Room Tab
+            living_layouts = ["Open", "Traditional", "Modern", "Minimalist"]
+            with room_tabs[0]:
+                col1, col2 = st.columns(2)
+                with col1:
+                    room_details["living_room"] = {
+                        "size": st.text_input("Size (sq ft)", key="living_size", 
+                            help="Enter the desired size in square feet"),
+                        "layout": st.selectbox("Preferred Layout", living_layouts, key="living_layout",
+                            index=living_layouts.index(FORM_DEFAULTS["room_details"]["living_room"]["layout"])),
+                        "features": st.multiselect("Special Features",
+                            ["Fireplace", "Entertainment Center", "Reading Nook", "Bar Area"], key="living_features")
+                    }
+
+            # Kitchen Tab
+            kitchen_layouts = ["Open", "Galley", "L-shaped", "U-shaped", "Island"]
+            with room_tabs[1]:
+                col1, col2 = st.columns(2)
+                with col1:
+                    room_details["kitchen"] = {
+                        "size": st.text_input("Size (sq ft)", key="kitchen_size",
+                            help="Enter the desired size in square feet"),
+                        "layout": st.selectbox("Preferred Layout", kitchen_layouts, key="kitchen_layout",
+                            index=kitchen_layouts.index(FORM_DEFAULTS["room_details"]["kitchen"]["layout"])),
+                        "features": st.multiselect("Special Features",
+                            ["Island", "Breakfast Bar", "Walk-in Pantry", "Wine Storage"], key="kitchen_features")
+                    }
+
+            # Master Bedroom Tab
+            with room_tabs[2]:
+                col1, col2 = st.columns(2)
+                with col1:
+                    room_details["master_bedroom"] = {
+                        "size": st.text_input("Size (sq ft)", key="master_size",
+                            help="Enter the desired size in square feet"),
+                        "features": st.multiselect("Special Features",
+                            ["Walk-in Closet", "En-suite Bathroom", "Sitting Area", "Balcony"], key="master_features")
+                    }
+
+            # Additional Requirements
+            st.subheader("Additional Requirements")
+            additional_requirements = st.text_area(
+                "Describe any specific requirements or preferences for your home design:",
+                placeholder="Example: Need a home office with natural light, prefer open concept living areas, want a mudroom for storage...",
+                height=100
+            )
+
+            # Timeline and Priority
+            st.subheader("Project Timeline and Priority")
             col1, col2 = st.columns(2)
             with col1:
-                room_details["master_bedroom"] = {
-                    "size": st.text_input("Size (sq ft)", key="master_size",
-                        help="Enter the desired size in square feet"),
-                    "features": st.multiselect("Special Features",
-                        ["Walk-in Closet", "En-suite Bathroom", "Sitting Area", "Balcony"], key="master_features")
-                }
-
-        # Additional Requirements
-        st.subheader("Additional Requirements")
-        additional_requirements = st.text_area(
-            "Describe any specific requirements or preferences for your home design:",
-            placeholder="Example: Need a home office with natural light, prefer open concept living areas, want a mudroom for storage...",
-            height=100
-        )
-
-        # Timeline and Priority
-        st.subheader("Project Timeline and Priority")
-        col1, col2 = st.columns(2)
-        with col1:
-            timeline = st.selectbox("Project Timeline",
-                ["Not specified", "Immediate (1-3 months)", "Short-term (3-6 months)", 
-                 "Medium-term (6-12 months)", "Long-term (1+ year)"])
-        with col2:
-            priority = st.selectbox("Design Priority",
-                ["Not specified", "Functionality", "Aesthetics", "Cost-effectiveness", 
-                 "Sustainability", "Resale Value"])
-        st.markdown('</div>', unsafe_allow_html=True)
-
-    # Generate button
-    if st.button("🚀 Generate Custom Home Design", type="primary", use_container_width=True):
+                timelines = ["Not specified", "Immediate (1-3 months)", "Short-term (3-6 months)",
+                             "Medium-term (6-12 months)", "Long-term (1+ year)"]
+                timeline = st.selectbox("Project Timeline", timelines,
+                    index=timelines.index(FORM_DEFAULTS["timeline"]))
+            with col2:
+                priority_options = ["Not specified", "Functionality", "Aesthetics", "Cost-effectiveness",
+                                    "Sustainability", "Resale Value"]
+                priority = st.selectbox("Design Priority", priority_options,
+                    index=priority_options.index(FORM_DEFAULTS["priority"]))
+            st.markdown('</div>', unsafe_allow_html=True)
+
+        # Variant comparison section
+        with st.expander("🔀 Compare Design Variants (Optional)"):
+            vary_label = st.radio("Compare plans that differ in", list(VARIED_FIELDS.values()), horizontal=True,
+                                  key="vary_field_input")
+            variant_styles = st.text_input(
+                "Other styles to compare",
+                placeholder="e.g., Rustic, Scandinavian",
+                help="Comma-separated; compared with the Design Style above",
+                key="variant_styles_input"
+            )
+            variant_priorities = st.multiselect("Priorities to compare", priority_options[1:],
+                                                key="variant_priorities_input")
+            st.caption("Variants are generated at the same time and shown side by side.")
+
+        # Generate button
+        submitted = st.form_submit_button("🚀 Generate Custom Home Design", type="primary", use_container_width=True)
+    lap("input widgets")
+
+    if submitted:
         try:
             # Validate inputs
             errors = validate_inputs(style, size, rooms)
-            
+            design_kwargs = dict(
+                room_details=room_details,
+                num_bedrooms=num_bedrooms,
+                num_bathrooms=num_bathrooms,
+                num_doors=num_doors,
+                num_windows=num_windows,
+                ceiling_height=ceiling_height,
+                floor_material=floor_material,
+                additional_requirements=additional_requirements,
+                timeline=timeline,
+                priority=priority
+            )
+            vary = next(field for field, label in VARIED_FIELDS.items() if label == vary_label)
+            if vary == "style":
+                variant_values = [style] + variant_styles.split(",") if variant_styles.strip() else []
+            else:
+                variant_values = variant_priorities
+            variants = variant_specs(style, size, rooms, vary, variant_values, **design_kwargs)
+            if len(variants) == 1:
+                # A single variant is the request itself, e.g. one priority picked to compare
+                style, design_kwargs["priority"] = variants[0]["style"], variants[0]["priority"]
+
             if errors:
                 for error in errors:
                     display_error(error)
+            elif len(variants) > 1:
+                run_variants(variants, image_source)
             else:
                 display_info("🎨 Creating your custom home design...")
-                
-                try:
-                    # Generate design idea
-                    st.session_state.design_idea = generate_design_idea(
-                        style=style,
-                        size=size,
-                        rooms=rooms,
-                        room_details=room_details,
-                        num_bedrooms=num_bedrooms,
-                        num_bathrooms=num_bathrooms,
-                        num_doors=num_doors,
-                        num_windows=num_windows,
-                        ceiling_height=ceiling_height,
-                        floor_material=floor_material,
-                        additional_requirements=additional_requirements,
-                        timeline=timeline,
-                        priority=priority
-                    )
-                    
-                    if st.session_state.design_idea:
-                        display_success("✅ Home design plan generated!")
+                st.session_state.variants = None
+                log_request(style, size, rooms, **design_kwargs)
+
+                # Rate-limit queue positions reported while waiting for admission (0 once out of the queue)
+                queue_positions = {}
+                shown_positions = {}
+
+                def show_queue_positions():
+                    nonlocal shown_positions
+                    # Copied: the image worker may report a position meanwhile
+                    positions = dict(queue_positions)
+                    if positions == shown_positions:
+                        return
+                    shown_positions = positions
+                    if positions:
+                        with queue_placeholder.container():
+                            for provider, position in positions.items():
+                                display_info(f"⏳ High demand right now: you are #{position} in the {provider} queue...")
                     else:
-                        display_error("⚠️ Could not generate design plan. Please try again.")
+                        queue_placeholder.empty()
 
-                except Exception as e:
-                    display_error(f"Error generating design plan: {str(e)}")
-                    st.session_state.design_idea = None
-
-                # Image generation/fetching
-                if st.session_state.design_idea:
+                def note_queue_position(provider, position, render=True):
+                    if position:
+                        queue_positions[provider] = position
+                    else:
+                        queue_positions.pop(provider, None)
+                    if render:
+                        show_queue_positions()
+
+                # The image only depends on style, size and rooms, so start it right away
+                if image_source == "AI Image Generation":
+                    display_info("✨ Generating design inspiration image using AI...")
+                    # Positions are reported from the worker thread; render them from this one
+                    image_future = submit_background(
+                        generate_stability_image, style, size, rooms,
+                        on_wait=lambda provider, position: note_queue_position(provider, position, render=False)
+                    )
+                else:
+                    display_info("🖼️ Fetching design inspiration image from Lexica.art...")
+                    image_future = submit_background(fetch_image_from_lexica, style)
+                st.session_state.design_style = style
+                # Only Lexica searches have more results to browse
+                st.session_state.gallery_style = style if image_source != "AI Image Generation" else None
+                st.session_state.gallery_page = 0
+
+                # Live results panel, filled in as each result becomes ready
+                live_results = st.empty()
+                with live_results.container():
+                    col1, col2 = st.columns([2, 1])
+                    with col1:
+                        st.markdown("## 📋 Your Custom Home Design Plan")
+                        plan_placeholder = st.empty()
+                    with col2:
+                        image_placeholder = st.empty()
+                status_placeholder = st.container()
+                queue_placeholder = st.empty()
+
+                image_shown = False
+
+                def show_image_when_ready(wait=False):
+                    nonlocal image_shown
+                    if image_shown or not (wait or image_future.done()):
+                        return
+                    image_shown = True
                     try:
-                        if image_source == "AI Image Generation":
-                            display_info("✨ Generating design inspiration image using AI...")
-                            st.session_state.image_url = generate_stability_image(style, size, rooms)
-                            if st.session_state.image_url:
+                        st.session_state.image_url = image_future.result()
+                    except Exception as e:
+                        st.session_state.image_url = None
+                        with status_placeholder:
+                            display_error(f"Error with image generation/fetching: {str(e)}")
+                        return
+                    with status_placeholder:
+                        if st.session_state.image_url:
+                            if image_source == "AI Image Generation":
                                 display_success("🎉 AI design inspiration image generated!")
                             else:
-                                display_error("⚠️ Could not generate AI image. Please try again.")
-                        else:
-                            display_info("🖼️ Fetching design inspiration image from Lexica.art...")
-                            st.session_state.image_url = fetch_image_from_lexica(style)
-                            if st.session_state.image_url:
                                 display_success("✔️ Design inspiration image fetched!")
-                            else:
-                                display_error("⚠️ Could not fetch image. Please try again.")
+                        elif image_source == "AI Image Generation":
+                            display_error("⚠️ Could not generate AI image. Please try again.")
+                        else:
+                            display_error("⚠️ Could not fetch image. Please try again.")
+                    if not st.session_state.image_url:
+                        return
+                    # Runs inside the plan's stream loop: a bad image must not abort the plan
+                    try:
+                        with image_placeholder.container():
+                            render_image(st.session_state.image_url, style)
                     except Exception as e:
-                        display_error(f"Error with image generation/fetching: {str(e)}")
+                        # Not kept either, so the results panel does not fail on it again
                         st.session_state.image_url = None
+                        image_placeholder.empty()
+                        with status_placeholder:
+                            display_error(f"Error displaying the design image: {str(e)}")
+
+                try:
+                    generate_plan = plan_generator()
+                    if STREAM_DESIGN_PLANS and generate_plan is generate_design_idea:
+                        # Render the plan progressively while Gemini is still writing it. The stream is
+                        # read on a worker, so a finished image is shown even before the first chunk.
+                        chunks = Queue()
+
+                        def read_stream():
+                            for text in stream_design_idea(
+                                style=style, size=size, rooms=rooms,
+                                on_wait=lambda provider, position: note_queue_position(provider, position, render=False),
+                                **design_kwargs
+                            ):
+                                chunks.put(text)
+
+                        stream_future = submit_background(read_stream)
+                        plan_text = None
+                        while not (stream_future.done() and chunks.empty()):
+                            try:
+                                plan_text = chunks.get(timeout=0.5)
+                                # Each chunk is the plan so far; skip to the latest
+                                while not chunks.empty():
+                                    plan_text = chunks.get_nowait()
+                                plan_placeholder.markdown(plan_text)
+                            except Empty:
+                                pass
+                            show_queue_positions()
+                            show_image_when_ready()
+                        stream_future.result()
+                        st.session_state.design_idea = plan_text
+                    else:
+                        # Positions are reported from the worker thread; render them from this one
+                        design_future = submit_background(
+                            generate_plan, style=style, size=size, rooms=rooms,
+                            on_wait=lambda provider, position: note_queue_position(provider, position, render=False),
+                            **design_kwargs
+                        )
+                        pending = {design_future, image_future}
+                        while pending:
+                            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                            show_queue_positions()
+                            if image_future in done:
+                                show_image_when_ready(wait=True)
+                            if design_future in done:
+                                st.session_state.design_idea = design_future.result()
+                                plan_placeholder.markdown(plan_markdown(st.session_state.design_idea))
+                    
+                    with status_placeholder:
+                        if st.session_state.design_idea:
+                            display_success("✅ Home design plan generated!")
+                        else:
+                            display_error("⚠️ Could not generate design plan. Please try again.")
+
+                except Exception as e:
+                    with status_placeholder:
+                        display_error(f"Error generating design plan: {str(e)}")
+                    st.session_state.design_idea = None
+
+                queue_placeholder.empty()
+                # A failed plan does not cancel the image; wait for it to finish
+                show_image_when_ready(wait=True)
+                # The results panel below renders the finished plan and image
+                live_results.empty()
 
         except Exception as e:
             display_error(f"An unexpected error occurred: {str(e)}")
+        lap("generation")
 
     # Display results if available
-    if st.session_state.design_idea:
-        st.markdown('<div class="section">', unsafe_allow_html=True)
-        
-        col1, col2 = st.columns([2, 1])
-        
-        with col1:
-            st.markdown("## 📋 Your Custom Home Design Plan")
-            st.markdown(st.session_state.design_idea)
-        
-        with col2:
-            if st.session_state.image_url:
-                st.markdown("## 🖼️ Design Inspiration")
-                st.markdown(f"""
-                <div class="image-container">
-                    <img src="{st.session_state.image_url}" alt="{style} Home Design Inspiration">
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                display_info("No image available at this time.")
-        
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Download option
-        st.markdown("---")
-        st.markdown("### 💾 Save Your Design")
-        st.download_button(
-            label="📄 Download Design Plan as Text",
-            data=st.session_state.design_idea,
-            file_name=f"{style.lower().replace(' ', '_')}_home_design.txt",
-            mime="text/plain"
-        )
+    if st.session_state.variants:
+        render_variants(st.session_state.variants)
+        lap("results rendering")
+    elif st.session_state.design_idea:
+        render_results(st.session_state.design_style)
+        lap("results rendering")
 
     st.markdown('</div>', unsafe_allow_html=True)
 
+def render_profile(profile):
+    """Show the last run's phase, call and CPU sample breakdown in the sidebar (profiling mode only)"""
+    if profile is None:
+        return
+    with st.sidebar:
+        st.header("⏱️ Profile")
+        st.caption(f"Last run: {profile.total * 1000:.0f} ms")
+        rows = "\n".join(f"| {name} | {seconds * 1000:.1f} |" for name, seconds in profile.phases)
+        st.markdown(f"| Phase | ms |\n|---|---:|\n{rows}")
+        if profile.calls:
+            rows = "\n".join(
+                f"| {name} | {count} | {seconds * 1000:.1f} |"
+                for name, (count, seconds) in sorted(profile.calls.items(), key=lambda item: -item[1][1])
+            )
+            st.markdown(f"| Call | n | ms |\n|---|---:|---:|\n{rows}")
+        if profile.sampler is not None and profile.sampler.samples:
+            rows = "\n".join(
+                f"| `{label}` | {cumulative:.0%} | {own:.0%} |"
+                for label, cumulative, own in profile.sampler.top(10)
+            )
+            st.markdown(f"{profile.sampler.samples} CPU samples\n\n| Function | total | self |\n|---|---:|---:|\n{rows}")
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    try:
+        main()
+    finally:
+        finish_rerun(rerun_profile)
+    render_profile(rerun_profile) 
\ No newline at end of file
@@ -0,0 +1,202 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils import (
+    IMAGE_SOURCES,
+    DesignUnavailable,
+    _design_options,
+    generate_design_idea,
+    generate_fallback_design,
+    validate_inputs,
+)
+
+logger = logging.getLogger(__name__)
+
+INTEGER_FIELDS = ("num_bedrooms", "num_bathrooms", "num_doors", "num_windows")
+JSON_FIELDS = ("room_details",)
+
+
+def _coerce_csv_row(row):
+    spec = {}
+    for key, value in row.items():
+        if value is None or value == "":
+            continue
+        if key in INTEGER_FIELDS:
+            value = int(value)
+        elif key in JSON_FIELDS:
+            value = json.loads(value)
+        spec[key] = value
+    return spec
+
+
+def read_specs(path):
+    """
+    Read design specs from a .jsonl or .csv file
+    """
+    with open(path, encoding="utf-8", newline="") as spec_file:
+        if path.lower().endswith(".csv"):
+            specs = [_coerce_csv_row(row) for row in csv.DictReader(spec_file)]
+        else:
+            specs = [json.loads(line) for line in spec_file if line.strip()]
+    for spec in specs:
+        # JSON specs may give numbers, e.g. "size": 2000; the generators take text
+        for field in ("style", "size", "rooms"):
+            value = spec.get(field)
+            spec[field] = "" if value is None else str(value)
+        spec.setdefault("id", spec_id(spec))
+    return specs
+
+
+def spec_id(spec):
+    """
+    Stable identifier for a spec, used to resume interrupted runs
+    """
+    raw = json.dumps(spec, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def completed_ids(output_path):
+    """
+    Return the ids of specs that already have an "ok" result in output_path.
+    Failed, fallback and invalid specs are retried; the last record for an id is its current result.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+                if record["status"] == "ok":
+                    done.add(record["id"])
+            except (ValueError, KeyError):
+                # A partially written last line from a crashed run
+                continue
+    return done
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def gemini_design(style, size, rooms, **kwargs):
+    """
+    Generate a plan with Gemini, raising DesignUnavailable instead of returning the fallback template
+    """
+    return generate_design_idea(style, size, rooms, allow_fallback=False, **kwargs)
+
+
+def generate_one(spec, design_fn=gemini_design, image_fn=None):
+    """
+    Validate and generate one spec, returning its result record.
+    Status is "ok", "invalid", "error", or "fallback" when Gemini could not be used.
+    """
+    started_at = time.monotonic()
+    record = {"id": spec["id"], "spec": spec}
+    # A malformed spec is recorded as an error rather than stopping the batch
+    try:
+        errors = validate_inputs(spec.get("style", ""), spec.get("size", ""), spec.get("rooms", ""))
+        if errors:
+            record.update(status="invalid", errors=errors)
+        else:
+            options = {k: v for k, v in spec.items() if k not in ("id", "style", "size", "rooms")}
+            record["design"] = design_fn(spec["style"], spec["size"], spec["rooms"], **options)
+            record["status"] = "ok"
+    except DesignUnavailable as e:
+        record.update(status="fallback", errors=[str(e)])
+    except Exception as e:
+        record.update(status="error", errors=[str(e)])
+    if image_fn is not None and record["status"] == "ok":
+        try:
+            record["image_url"] = image_fn(spec)
+        except Exception as e:
+            record["image_error"] = str(e)
+    record["latency"] = time.monotonic() - started_at
+    return record
+
+
+def run_batch(specs, output_path, concurrency=4, design_fn=gemini_design, image_fn=None):
+    """
+    Generate every spec not already in output_path and return a summary dict.
+
+    Results are appended (and fsynced) as they finish, so output_path is also the
+    checkpoint for resuming a crashed run. design_fn and image_fn can be replaced
+    with stubs to run without network access.
+    """
+    done = completed_ids(output_path)
+    pending = [spec for spec in specs if spec["id"] not in done]
+    logger.info(f"{len(done)} specs already complete, {len(pending)} to generate")
+
+    write_lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    started_at = time.monotonic()
+    with open(output_path, "a", encoding="utf-8") as output_file, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(generate_one, spec, design_fn, image_fn) for spec in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            with write_lock:
+                output_file.write(json.dumps(record, default=str) + "\n")
+                output_file.flush()
+                os.fsync(output_file.fileno())
+            latencies.append(record["latency"])
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    elapsed = time.monotonic() - started_at
+
+    return {
+        "skipped": len(done),
+        "generated": len(pending),
+        "statuses": statuses,
+        "elapsed": elapsed,
+        "throughput": len(pending) / elapsed if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies, default=0.0),
+    }
+
+
+def _offline_design(style, size, rooms, **kwargs):
+    # Deterministic stand-in for Gemini, built from the fallback template
+    return generate_fallback_design(style, size, rooms, **_design_options(kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate design plans for every spec in a JSONL or CSV file")
+    parser.add_argument("specs", help="input spec file (.jsonl or .csv)")
+    parser.add_argument("output", help="output JSONL file; also used to resume interrupted runs")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of generations run in parallel")
+    parser.add_argument("--image-source", choices=sorted(IMAGE_SOURCES), default="none")
+    parser.add_argument("--offline", action="store_true",
+                        help="use the local fallback template instead of Gemini and skip images")
+    args = parser.parse_args()
+
+    specs = read_specs(args.specs)
+    if args.offline:
+        summary = run_batch(specs, args.output, args.concurrency, design_fn=_offline_design)
+    else:
+        summary = run_batch(specs, args.output, args.concurrency, image_fn=IMAGE_SOURCES[args.image_source])
+
+    print(f"Skipped (already done): {summary['skipped']}")
+    print(f"Generated:              {summary['generated']} {summary['statuses']}")
+    print(f"Elapsed:                {summary['elapsed']:.1f}s")
+    print(f"Throughput:             {summary['throughput']:.2f} specs/s")
+    print(f"Latency p50/p95/max:    {summary['latency_p50']:.2f}s / {summary['latency_p95']:.2f}s / {summary['latency_max']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import base64
+import functools
+import hashlib
+import io
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Latency (seconds, mean and +/- jitter) and error profiles for each fake provider.
+# Gemini latency is the time to the complete plan; streamed chunks are spread over it.
+PROFILES = {
+    "fast": {
+        "gemini": {"latency": 0.05, "jitter": 0.01, "error_rate": 0.0},
+        "lexica": {"latency": 0.01, "jitter": 0.005, "error_rate": 0.0},
+        "stability": {"latency": 0.05, "jitter": 0.01, "error_rate": 0.0},
+    },
+    "realistic": {
+        "gemini": {"latency": 2.0, "jitter": 0.5, "error_rate": 0.0},
+        "lexica": {"latency": 0.3, "jitter": 0.2, "error_rate": 0.0},
+        "stability": {"latency": 4.0, "jitter": 1.0, "error_rate": 0.0},
+    },
+    "flaky": {
+        "gemini": {"latency": 2.0, "jitter": 1.5, "error_rate": 0.2},
+        "lexica": {"latency": 0.5, "jitter": 1.0, "error_rate": 0.2},
+        "stability": {"latency": 4.0, "jitter": 2.0, "error_rate": 0.2},
+    },
+}
+
+STREAM_CHUNKS = 8
+# Share of a structured Gemini call's latency that does not depend on output length (prompt processing, first token)
+FIXED_LATENCY_SHARE = 0.2
+# Output tokens of a real schema-complete JSON plan (the fake one is far shorter); checked against maxOutputTokens
+FULL_PLAN_TOKENS = 3000
+
+FAKE_PLAN = """# {style} Home Design Plan
+
+## 1. Overall Design Concept
+A {style} home with {rooms} rooms, planned around natural light and clear circulation.
+
+## 2. Floor Plan Layout
+Open living areas face the garden; bedrooms are grouped in a quiet wing.
+
+## 3. Room-by-Room Breakdown
+Each room is sized for its use, with storage built into every bedroom.
+
+## 4. Materials and Finishes
+Durable, low-maintenance materials in a palette typical of {style} design.
+
+## 5. Lighting and Ventilation
+Cross-ventilation in every main room and layered artificial lighting.
+"""
+
+
+def fake_plan_json(style, rooms, fields=None):
+    """
+    A structured plan (utils.generate_design_plan) with every schema field filled,
+    or only the given sections (utils.generate_sectioned_plan)
+    """
+    from plan import POINT_SECTIONS
+
+    plan = {
+        "title": f"{style} Home Design Plan",
+        "overview": f"A {style} home with {rooms} rooms, planned around natural light and clear circulation.",
+        "rooms": [{"name": "Living Room", "dimensions": "16ft x 20ft", "purpose": "Family gathering",
+                   "features": ["Garden-facing windows", "Built-in shelving"]}],
+        "materials": [{"name": "Oak flooring", "use": f"Main living areas, typical of {style} design"}],
+    }
+    plan.update({field: [f"{field.replace('_', ' ').capitalize()} suited to a {style} home"] for field in POINT_SECTIONS})
+    if fields is not None:
+        plan = {field: plan[field] for field in fields if field in plan}
+    return json.dumps(plan)
+
+
+class FakeProvider:
+    """
+    A local HTTP server standing in for one provider API.
+
+    Every request waits for the profile's latency (mean +/- jitter) and fails
+    with error_status at error_rate. Randomness is seeded, so a profile gives
+    the same sequence of latencies and errors on every run.
+    """
+
+    def __init__(self, name, handler, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=0):
+        self.name = name
+        self.handle = handler
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(f"{name}-{seed}")
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler_class(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"fake-{name}", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def draw(self):
+        """
+        Return (delay, failed) for the next request
+        """
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.error_rate
+            self.errors += failed
+            return delay, failed
+
+
+def _handler_class(provider):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _serve(self):
+            body = self._body() if self.command == "POST" else {}
+            delay, failed = provider.draw()
+            if failed:
+                time.sleep(delay)
+                self.send_json(provider.error_status, {"error": {"code": provider.error_status, "message": "fake outage"}})
+                return
+            provider.handle(self, body, delay)
+
+        do_GET = _serve
+        do_POST = _serve
+
+    return Handler
+
+
+def _prompt_text(body):
+    parts = [part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])]
+    return "\n".join(parts)
+
+
+def _spec_field(prompt, label, default):
+    for line in prompt.splitlines():
+        name, _, value = line.strip().partition(":")
+        if name == label and value.strip():
+            return value.strip()
+    return default
+
+
+def _gemini_response(text, prompt, finish_reason="STOP"):
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": finish_reason,
+                        "index": 0}],
+        "usageMetadata": {
+            "promptTokenCount": len(prompt) // 4,
+            "candidatesTokenCount": len(text) // 4,
+            "totalTokenCount": (len(prompt) + len(text)) // 4,
+        },
+    }
+
+
+def handle_gemini(request, body, delay):
+    """
+    Gemini REST API (v1beta): generateContent, streamGenerateContent and countTokens.
+    Streams are sent as the JSON array the REST transport reads incrementally.
+    """
+    path = urlsplit(request.path).path
+    prompt = _prompt_text(body)
+    if path.endswith(":countTokens"):
+        request.send_json(200, {"totalTokens": len(prompt) // 4})
+        return
+    style, rooms = _spec_field(prompt, "Style", "Custom"), _spec_field(prompt, "Number of Rooms", "several")
+    generation_config = body.get("generationConfig") or body.get("generation_config") or {}
+    finish_reason = "STOP"
+    if "application/json" in (generation_config.get("responseMimeType"), generation_config.get("response_mime_type")):
+        schema = generation_config.get("responseSchema") or generation_config.get("response_schema") or {}
+        plan = fake_plan_json(style, rooms, schema.get("properties"))
+        share = len(plan) / len(fake_plan_json(style, rooms))
+        # Generation time grows with output length: scale the full-plan latency by the share written
+        delay *= FIXED_LATENCY_SHARE + (1 - FIXED_LATENCY_SHARE) * share
+        # Cut the JSON off where a real plan of this size would reach the output limit
+        max_tokens = generation_config.get("maxOutputTokens") or generation_config.get("max_output_tokens")
+        if max_tokens and FULL_PLAN_TOKENS * share > max_tokens:
+            plan = plan[:int(len(plan) * max_tokens / (FULL_PLAN_TOKENS * share))]
+            finish_reason = "MAX_TOKENS"
+    else:
+        plan = FAKE_PLAN.format(style=style, rooms=rooms)
+    if not path.endswith(":streamGenerateContent"):
+        time.sleep(delay)
+        request.send_json(200, _gemini_response(plan, prompt, finish_reason))
+        return
+
+    step = -(-len(plan) // STREAM_CHUNKS)
+    chunks = [plan[i:i + step] for i in range(0, len(plan), step)]
+    request.send_response(200)
+    request.send_header("Content-Type", "application/json")
+    request.send_header("Transfer-Encoding", "chunked")
+    request.end_headers()
+
+    def write(data):
+        encoded = data.encode("utf-8")
+        request.wfile.write(f"{len(encoded):x}\r\n".encode("ascii") + encoded + b"\r\n")
+        request.wfile.flush()
+
+    for index, chunk in enumerate(chunks):
+        time.sleep(delay / len(chunks))
+        response = _gemini_response(chunk, prompt if index == len(chunks) - 1 else "")
+        write(("[" if index == 0 else ",\n") + json.dumps(response))
+    write("]")
+    request.wfile.write(b"0\r\n\r\n")
+
+
+def handle_lexica(request, body, delay):
+    """
+    Lexica search API plus the image URLs it returns
+    """
+    time.sleep(delay)
+    parts = urlsplit(request.path)
+    if parts.path.startswith("/images/"):
+        data = fake_jpeg()
+        request.send_response(200)
+        request.send_header("Content-Type", "image/jpeg")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+        return
+    query = parse_qs(parts.query).get("q", [""])[0]
+    limit = int(parse_qs(parts.query).get("limit", ["10"])[0])
+    slug = hashlib.sha256(query.encode("utf-8")).hexdigest()[:12]
+    base = f"http://{request.headers.get('Host')}"
+    request.send_json(200, {"images": [
+        {"src": f"{base}/images/{slug}-{i}.jpg", "srcSmall": f"{base}/images/{slug}-{i}-small.jpg", "prompt": query}
+        for i in range(limit)
+    ]})
+
+
+@functools.lru_cache(maxsize=1)
+def fake_png():
+    """
+    A real 512x512 PNG, built once, so the app renders generated images as it would in production
+    """
+    from PIL import Image
+
+    gradient = Image.radial_gradient("L").resize((512, 512))
+    image = Image.merge("RGB", (gradient, gradient.rotate(90), gradient.rotate(180)))
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+@functools.lru_cache(maxsize=1)
+def fake_jpeg():
+    """
+    A real 256x256 JPEG, built once, served for every Lexica image and thumbnail
+    """
+    from PIL import Image
+
+    gradient = Image.linear_gradient("L").resize((256, 256))
+    image = Image.merge("RGB", (gradient.rotate(90), gradient, gradient.rotate(270)))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=80)
+    return output.getvalue()
+
+
+def handle_stability(request, body, delay):
+    """
+    Stability AI text-to-image API, returning the same valid PNG for every prompt
+    """
+    time.sleep(delay)
+    request.send_json(200, {"artifacts": [
+        {"base64": base64.b64encode(fake_png()).decode("ascii"), "finishReason": "SUCCESS", "seed": 0}
+    ]})
+
+
+HANDLERS = {"gemini": handle_gemini, "lexica": handle_lexica, "stability": handle_stability}
+
+
+def start_fake_providers(profile="fast", seed=0):
+    """
+    Start one fake server per provider with the named profile and return {name: FakeProvider}
+    """
+    return {
+        name: FakeProvider(name, HANDLERS[name], seed=seed, **settings).start()
+        for name, settings in PROFILES[profile].items()
+    }
@@ -0,0 +1,224 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from benchmarks.fake_providers import PROFILES, start_fake_providers
+from benchmarks.run import STYLES, configure_environment
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SOURCES = ("stability", "lexica")
+
+
+def current_rss_bytes():
+    """
+    Resident set size of this process (peak RSS where /proc is unavailable)
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ResourceSampler:
+    """
+    Samples thread count and RSS in the background and keeps the peaks
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.max_threads = 0
+        self.max_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.max_threads = max(self.max_threads, threading.active_count())
+            self.max_rss = max(self.max_rss, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+class SpecSource:
+    """
+    Hands out design requests: unique ones (cache misses) except for hot_fraction
+    of requests, which repeat a small set of popular specs (cache hits once warm)
+    """
+
+    def __init__(self, hot_fraction=0.0, seed=0):
+        self.hot_fraction = hot_fraction
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def next(self):
+        with self._lock:
+            self._counter += 1
+            hot = self._random.random() < self.hot_fraction
+            index = self._random.randrange(len(STYLES)) if hot else self._counter
+        style = STYLES[index % len(STYLES)]
+        if hot:
+            return {"style": style, "size": "2000 sq ft", "rooms": "6"}
+        # Unique size, rooms and requirements, so no cache can serve it (for the first 5000 requests)
+        return {"style": style, "size": f"{1000 + 250 * (index // 50 % 100)} sq ft", "rooms": str(1 + index % 50),
+                "additional_requirements": f"load test request {index}"}
+
+
+def simulate_session(spec, image_source, stream):
+    """
+    Do what app.main does for one click on Generate, minus the rendering: log the
+    request, start the image in the background, produce the plan on this (session)
+    thread and wait for the image. Keep in step with the Generate handler in app.py.
+    Returns True if an image was produced.
+    """
+    from normalize import log_request
+    from utils import (
+        fetch_image_from_lexica,
+        generate_design_idea,
+        generate_stability_image,
+        stream_design_idea,
+        submit_background,
+    )
+
+    log_request(spec["style"], spec["size"], spec["rooms"])
+    if image_source == "stability":
+        image_future = submit_background(generate_stability_image, spec["style"], spec["size"], spec["rooms"])
+    else:
+        image_future = submit_background(fetch_image_from_lexica, spec["style"])
+    if stream:
+        for _ in stream_design_idea(**spec):
+            pass
+    else:
+        design_future = submit_background(generate_design_idea, **spec)
+        pending = {design_future, image_future}
+        while design_future in pending:
+            _, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+        design_future.result()
+    return image_future.result() is not None
+
+
+def run_step(sessions, duration, spec_source, image_source, stream, think_time):
+    """
+    Run sessions closed-loop virtual users for duration seconds and return the step's report
+    """
+    from batch import percentile
+    from metrics import snapshot
+
+    def total(counter):
+        return sum(value for (name, _), value in snapshot().items() if name == counter)
+
+    latencies = []
+    outcomes = {"ok": 0, "no_image": 0, "error": 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def user():
+        while time.monotonic() < stop_at:
+            started_at = time.monotonic()
+            try:
+                outcome = "ok" if simulate_session(spec_source.next(), image_source, stream) else "no_image"
+            except Exception as e:
+                logger.warning(f"Simulated session failed: {e}")
+                outcome = "error"
+            with lock:
+                latencies.append(time.monotonic() - started_at)
+                outcomes[outcome] += 1
+            time.sleep(think_time)
+
+    fallbacks_before = total("gemini_fallbacks_total")
+    rejected_before = total("admission_rejected_total")
+    started_at = time.monotonic()
+    with ResourceSampler() as sampler:
+        users = [threading.Thread(target=user, name=f"session-{i}") for i in range(sessions)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+    elapsed = time.monotonic() - started_at
+    outcomes["fallback_plans"] = total("gemini_fallbacks_total") - fallbacks_before
+    outcomes["admission_rejected"] = total("admission_rejected_total") - rejected_before
+    return {
+        "sessions": sessions,
+        "completed": len(latencies),
+        "outcomes": outcomes,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max_threads": sampler.max_threads,
+        "max_rss": sampler.max_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ramp up concurrent simulated sessions against local fake providers and report capacity"
+    )
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic", help="provider latency/error profile")
+    parser.add_argument("--steps", default="1,2,4,8,16,32", help="comma-separated concurrent session counts")
+    parser.add_argument("--duration", type=float, default=30, help="seconds each step runs")
+    parser.add_argument("--think-time", type=float, default=1.0, help="seconds a user waits between requests")
+    parser.add_argument("--image-source", choices=IMAGE_SOURCES, default="stability")
+    parser.add_argument("--blocking", action="store_true", help="generate plans without streaming")
+    parser.add_argument("--hot-fraction", type=float, default=0.0,
+                        help="share of requests repeating popular specs (cache hits)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--unlimited", action="store_true",
+                        help="lift the provider rate limits to measure the providers alone")
+    parser.add_argument("--output", help="also write the step reports to this JSON file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    providers = start_fake_providers(args.profile, args.seed)
+    configure_environment(providers, tempfile.mkdtemp(prefix="smarthome-load-"), unlimited=args.unlimited)
+    # Every unique request must reach the providers; hot specs still hit the exact cache
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+    spec_source = SpecSource(args.hot_fraction, args.seed)
+    reports = []
+    print(f"{'sessions':>8} {'done':>6} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'threads':>8} {'rss MiB':>8}  outcomes")
+    try:
+        for sessions in (int(step) for step in args.steps.split(",")):
+            report = run_step(sessions, args.duration, spec_source, args.image_source, not args.blocking,
+                              args.think_time)
+            reports.append(report)
+            print(f"{report['sessions']:>8} {report['completed']:>6} {report['throughput']:>7.2f} "
+                  f"{report['p50']:>7.2f}s {report['p95']:>7.2f}s {report['p99']:>7.2f}s "
+                  f"{report['max_threads']:>8} {report['max_rss'] / 2 ** 20:>8.1f}  {report['outcomes']}")
+    finally:
+        for provider in providers.values():
+            provider.stop()
+
+    baseline = reports[0]["p95"] if reports else 0.0
+    saturated = next((r["sessions"] for r in reports if baseline and r["p95"] > 2 * baseline), None)
+    if saturated:
+        print(f"\np95 latency more than doubled from the single-session baseline at {saturated} sessions")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"profile": args.profile, "image_source": args.image_source, "stream": not args.blocking,
+                       "hot_fraction": args.hot_fraction, "unlimited": args.unlimited, "steps": reports},
+                      output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+
+from benchmarks.fake_providers import PROFILES, start_fake_providers
+from benchmarks.run import REPO_ROOT, configure_environment
+
+logger = logging.getLogger(__name__)
+
+# Inputs typed into the form before "Generate"; matched by label so older app.py trees work too
+FORM_VALUES = {
+    "Design Style": "Modern Minimalist",
+    "Home Size": "2500 sq ft",
+    "Number of Rooms": "3",
+}
+LEXICA_LABEL = "design inspiration images"
+LEXICA_INDEX = 1
+
+
+class RerunClient:
+    """
+    Talks to a running `streamlit run` server the way the browser does: sends
+    rerun requests over the websocket and counts the ForwardMsg frames and bytes
+    sent back until the script (or fragment) finishes
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.widgets = {}  # label -> (widget id, fragment id)
+        self.states = {}  # widget id -> WidgetState fields sent with every rerun
+        self.connection = None
+
+    async def connect(self):
+        self.connection = await websocket_connect(self.url, max_message_size=1 << 30)
+
+    def widget(self, label):
+        return next(value for name, value in self.widgets.items() if label in name)
+
+    def set_value(self, label, **fields):
+        self.states[self.widget(label)[0]] = fields
+
+    async def rerun(self, trigger=None, fragment_id=""):
+        """
+        Request a rerun and return (seconds, bytes, frames) until script_finished
+        """
+        message = BackMsg()
+        client_state = message.rerun_script
+        client_state.fragment_id = fragment_id
+        for widget_id, fields in self.states.items():
+            state = client_state.widget_states.widgets.add(id=widget_id)
+            for name, value in fields.items():
+                setattr(state, name, value)
+        if trigger:
+            client_state.widget_states.widgets.add(id=trigger, trigger_value=True)
+
+        start = time.perf_counter()
+        total_bytes = frames = 0
+        await self.connection.write_message(message.SerializeToString(), binary=True)
+        while True:
+            frame = await self.connection.read_message()
+            if frame is None:
+                raise RuntimeError("Streamlit server closed the websocket")
+            total_bytes += len(frame)
+            frames += 1
+            forward = ForwardMsg()
+            forward.ParseFromString(frame)
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                self._note_widget(forward.delta)
+            elif kind == "script_finished":
+                return time.perf_counter() - start, total_bytes, frames
+
+    def _note_widget(self, delta):
+        element = delta.new_element
+        proto = getattr(element, element.WhichOneof("type"))
+        if getattr(proto, "id", "") and hasattr(proto, "label"):
+            self.widgets[proto.label] = (proto.id, delta.fragment_id)
+
+
+def _summary(runs):
+    return {
+        "median_s": statistics.median(run[0] for run in runs),
+        "bytes": statistics.median(run[1] for run in runs),
+        "frames": statistics.median(run[2] for run in runs),
+    }
+
+
+async def measure(url, repeats):
+    """
+    First render, a Lexica generation, full reruns with results on screen and
+    gallery page turns (a fragment rerun where the app uses one)
+    """
+    client = RerunClient(url)
+    await client.connect()
+    report = {"first_render": _summary([await client.rerun()])}
+    for label, value in FORM_VALUES.items():
+        client.set_value(label, string_value=value)
+    client.set_value(LEXICA_LABEL, int_value=LEXICA_INDEX)
+    report["generate_lexica"] = _summary([await client.rerun(trigger=client.widget("Generate")[0])])
+    report["rerun_with_results"] = _summary([await client.rerun() for _ in range(repeats)])
+
+    pages = []
+    for index in range(repeats):
+        button_id, fragment_id = client.widget("Next" if index % 2 == 0 else "Previous")
+        pages.append(await client.rerun(trigger=button_id, fragment_id=fragment_id))
+    report["gallery_page"] = _summary(pages)
+    report["gallery_page"]["fragment"] = bool(client.widget("Next")[1])
+    client.connection.close()
+    return report
+
+
+def start_server(tree, port, env):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "app.py", "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://localhost:{port}/_stcore/health", timeout=1).ok:
+                return server
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"Streamlit server in {tree} did not become healthy")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure rerun time and websocket payloads of a real Streamlit server against fake providers"
+    )
+    parser.add_argument("--tree", default=REPO_ROOT, help="checkout whose app.py is served (e.g. a git worktree)")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast", help="provider latency/error profile")
+    parser.add_argument("--repeats", type=int, default=20, help="reruns and gallery page turns measured")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    providers = start_fake_providers(args.profile)
+    configure_environment(providers, tempfile.mkdtemp(prefix="smarthome-rerun-"), unlimited=True)
+    server = start_server(args.tree, args.port, dict(os.environ))
+    try:
+        report = IOLoop.current().run_sync(
+            lambda: measure(f"ws://localhost:{args.port}/_stcore/stream", args.repeats), timeout=600
+        )
+    finally:
+        server.terminate()
+        server.wait()
+        for provider in providers.values():
+            provider.stop()
+
+    print(f"{'interaction':<20} {'median':>9} {'bytes':>8} {'frames':>7}")
+    for name, row in report.items():
+        print(f"{name:<20} {row['median_s'] * 1000:>7.1f}ms {row['bytes']:>8.0f} {row['frames']:>7.0f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_providers import PROFILES, start_fake_providers
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HISTORY = os.path.join(REPO_ROOT, "benchmarks", "history.jsonl")
+
+STYLES = ["Modern", "Traditional", "Contemporary", "Rustic", "Mediterranean",
+          "Colonial", "Craftsman", "Victorian", "Minimalist", "Industrial"]
+SIZES = ["2000 sq ft", "1500 sq ft", "3000 sq ft"]
+
+# The same requirement worded two ways, to exercise the semantic cache
+REQUIREMENT = "home office with natural light"
+REWORDED_REQUIREMENT = "Natural light, home office"
+
+# A typical editing session: one field changed per regeneration, cumulatively
+EDIT_SEQUENCE = [
+    {"floor_material": "Polished concrete"},
+    {"room_details": {"kitchen": {"layout": "Galley", "features": ["Island", "Pantry"]}}},
+    {"timeline": "6-12 months"},
+    {"num_windows": 12},
+]
+
+# Only metrics with these suffixes are compared between runs; larger is worse for all of them
+REGRESSION_SUFFIXES = ("_s", "_bytes")
+
+
+def configure_environment(providers, workdir, unlimited=False):
+    """
+    Point the app at the fake providers and at fresh cache directories.
+    Provider rate limits stay as configured unless unlimited is set.
+    Must run before config (and anything importing it) is imported.
+    """
+    os.environ.update({
+        "GOOGLE_API_KEY": "benchmark-key",
+        "STABILITY_AI_API_KEY": "benchmark-key",
+        "GEMINI_API_ENDPOINT": providers["gemini"].url,
+        "GEMINI_TRANSPORT": "rest",
+        "LEXICA_BASE_URL": f"{providers['lexica'].url}/api/v1/search",
+        "STABILITY_API_HOST": providers["stability"].url,
+        "CACHE_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "BLOB_STORE_PATH": os.path.join(workdir, "blobs"),
+        "REQUEST_LOG_PATH": "",
+        # Opt-in in the app; enabled here so the semantic-hit phase has something to measure
+        "SEMANTIC_CACHE_ENABLED": "true",
+    })
+    if unlimited:
+        # Measure the providers, not the admission queue
+        os.environ.update({"GEMINI_REQUESTS_PER_MIN": "100000", "STABILITY_REQUESTS_PER_MIN": "100000"})
+
+
+def build_specs(count):
+    specs = []
+    for index in range(count):
+        style = STYLES[index % len(STYLES)]
+        size = SIZES[(index // len(STYLES)) % len(SIZES)]
+        specs.append({"style": style, "size": size, "rooms": str(4 + index % 4),
+                      "additional_requirements": REQUIREMENT})
+    return specs
+
+
+def _time(func, *args, **kwargs):
+    started_at = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started_at
+
+
+def _latency_metrics(prefix, latencies):
+    from batch import percentile
+
+    return {
+        f"{prefix}.p50_s": percentile(latencies, 50),
+        f"{prefix}.p95_s": percentile(latencies, 95),
+        f"{prefix}.max_s": max(latencies, default=0.0),
+    }
+
+
+def _counter_totals():
+    from metrics import snapshot
+
+    totals = {}
+    for (name, labels), value in snapshot().items():
+        label_text = ",".join(f"{key}={label}" for key, label in labels)
+        totals[f"{name}{{{label_text}}}" if label_text else name] = value
+    return totals
+
+
+def _path_counts(prefix, before, after, names):
+    # Counter increases during one phase, e.g. how many lookups hit the design cache
+    counts = {}
+    for key, value in after.items():
+        if any(key.startswith(name) for name in names):
+            delta = value - before.get(key, 0)
+            if delta:
+                counts[f"{prefix}.{key}_count"] = delta
+    return counts
+
+
+DESIGN_COUNTERS = ("cache_lookups_total{namespace=design", "semantic_cache_lookups_total",
+                   "gemini_requests_total", "gemini_fallbacks_total", "singleflight")
+IMAGE_COUNTERS = ("cache_lookups_total{namespace=lexica", "cache_lookups_total{namespace=stability",
+                  "http_retries_total", "http_hedged_requests_total")
+
+
+def bench_design(specs):
+    """
+    Blocking generation latency on a cold cache, the exact-hit path and the semantic-hit path
+    """
+    from utils import generate_design_idea
+
+    metrics = {}
+    phases = [
+        ("design.cold", specs),
+        ("design.exact_hit", specs),
+        ("design.semantic_hit", [dict(spec, additional_requirements=REWORDED_REQUIREMENT) for spec in specs]),
+    ]
+    for prefix, phase_specs in phases:
+        before = _counter_totals()
+        latencies = [_time(generate_design_idea, **spec)[1] for spec in phase_specs]
+        metrics.update(_latency_metrics(prefix, latencies))
+        metrics.update(_path_counts(prefix, before, _counter_totals(), DESIGN_COUNTERS))
+    return metrics
+
+
+def bench_stream(specs):
+    """
+    Time to the complete plan for streamed generations on a cold cache.
+
+    Time to first chunk is not reported: the REST transport used against the
+    fake server reads the whole response before yielding the first chunk.
+    """
+    from utils import stream_design_idea
+
+    complete = []
+    for spec in specs:
+        # A size no other phase uses, so every request misses the cache
+        spec = dict(spec, size="4000 sq ft")
+        started_at = time.perf_counter()
+        for _ in stream_design_idea(**spec):
+            pass
+        complete.append(time.perf_counter() - started_at)
+    return _latency_metrics("stream.complete", complete)
+
+
+def bench_edits(spec):
+    """
+    Regenerate a plan through EDIT_SEQUENCE, once as whole structured plans and
+    once section by section, reporting latency and the Gemini tokens spent per edit
+    """
+    from utils import generate_design_plan, generate_sectioned_plan
+
+    metrics = {}
+    for prefix, generate in (("edits.full", generate_design_plan), ("edits.sectioned", generate_sectioned_plan)):
+        current = dict(spec)
+        generate(**current)  # The plan being edited; not counted
+        before = _counter_totals()
+        latencies = []
+        for change in EDIT_SEQUENCE:
+            current.update(change)
+            latencies.append(_time(generate, **current)[1])
+        after = _counter_totals()
+        metrics.update(_latency_metrics(prefix, latencies))
+        for name in ("gemini_input_tokens_total", "gemini_output_tokens_total", "design_sections_total{result=generated"):
+            spent = sum(value - before.get(key, 0) for key, value in after.items() if key.startswith(name))
+            metrics[f"{prefix}.{name.partition('{')[0]}_per_edit_count"] = spent / len(EDIT_SEQUENCE)
+    return metrics
+
+
+def bench_fanout(specs):
+    """
+    Cold sectioned plans generated by one Gemini call and fanned out into concurrent section group calls
+    """
+    from utils import generate_sectioned_plan
+
+    metrics = {}
+    for prefix, fanout in (("sections.single_call", False), ("sections.fanout", True)):
+        # Requirements are an input of every section, so neither mode reuses the other's sections
+        phase_specs = [dict(spec, additional_requirements=f"{REQUIREMENT} ({prefix})") for spec in specs]
+        before = _counter_totals()
+        latencies = [_time(generate_sectioned_plan, fanout=fanout, **spec)[1] for spec in phase_specs]
+        metrics.update(_latency_metrics(prefix, latencies))
+        metrics.update(_path_counts(prefix, before, _counter_totals(), ("gemini_requests_total", "gemini_fallbacks_total")))
+    return metrics
+
+
+def bench_images(specs):
+    """
+    Lexica search and Stability generation latency, cold and cached
+    """
+    from utils import fetch_image_from_lexica, generate_stability_image
+
+    metrics = {}
+    styles = sorted({spec["style"] for spec in specs})
+    for phase in ("cold", "cached"):
+        before = _counter_totals()
+        latencies = [_time(fetch_image_from_lexica, style)[1] for style in styles]
+        metrics.update(_latency_metrics(f"lexica.{phase}", latencies))
+        latencies = [_time(generate_stability_image, spec["style"], spec["size"], spec["rooms"])[1] for spec in specs]
+        metrics.update(_latency_metrics(f"stability.{phase}", latencies))
+        metrics.update(_path_counts(f"images.{phase}", before, _counter_totals(), IMAGE_COUNTERS))
+    return metrics
+
+
+def _submit(app_test, spec, image_source=None):
+    if image_source is not None:
+        next(radio for radio in app_test.radio if image_source in radio.options).set_value(image_source)
+    app_test.text_input(key="design_style_input").set_value(spec["style"])
+    app_test.text_input(key="home_size_input").set_value(spec["size"])
+    app_test.text_input(key="rooms_input").set_value(spec["rooms"])
+    next(button for button in app_test.button if "Generate" in button.label).click()
+    return app_test.run()
+
+
+def bench_app(spec, sessions):
+    """
+    Drive app.main through Streamlit's AppTest: first render, an end-to-end
+    generation, a full rerun with results on screen, and the Python heap held
+    per additional session with results.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    script = os.path.join(REPO_ROOT, "app.py")
+    metrics = {}
+
+    app_test = AppTest.from_file(script, default_timeout=300)
+    _, metrics["app.first_render_s"] = _time(app_test.run)
+    _, metrics["app.generate_cold_s"] = _time(_submit, app_test, spec)
+    reruns = [_time(app_test.run)[1] for _ in range(5)]
+    metrics.update(_latency_metrics("app.rerun_with_results", reruns))
+
+    # The Lexica path, with its thumbnail gallery
+    lexica_test = AppTest.from_file(script, default_timeout=300)
+    lexica_test.run()
+    _, metrics["app.generate_lexica_s"] = _time(_submit, lexica_test, spec, "Lexica.art (Image Search)")
+    metrics["app.gallery_images_count"] = len(lexica_test.get("imgs"))
+    metrics["app.exceptions_count"] = len(app_test.exception) + len(lexica_test.exception)
+
+    # Every session below is served from the caches filled above
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    live_sessions = []
+    generate_latencies = []
+    for _ in range(sessions):
+        session = AppTest.from_file(script, default_timeout=300)
+        session.run()
+        generate_latencies.append(_time(_submit, session, spec)[1])
+        live_sessions.append(session)
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    metrics.update(_latency_metrics("app.generate_cached", generate_latencies))
+    metrics["app.memory_per_session_bytes"] = held / max(1, sessions)
+    return metrics
+
+
+def run_problems(providers, profile):
+    """
+    Reasons the run did not measure the normal Gemini path (e.g. the client never
+    reached the fake server and every phase timed the fallback plan), or []
+    """
+    problems = []
+    if not providers["gemini"].requests:
+        problems.append("the fake Gemini server received no requests; check the Gemini client and GEMINI_API_ENDPOINT")
+    fallbacks = sum(value for key, value in _counter_totals().items()
+                    if key.startswith(("gemini_fallbacks_total", "structured_plan_fallbacks_total")))
+    # The flaky profile fails requests on purpose, so fallbacks are part of what it measures
+    if fallbacks and not PROFILES[profile]["gemini"]["error_rate"]:
+        problems.append(f"{fallbacks:g} design requests were served a fallback plan instead of Gemini's")
+    return problems
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(history_path, profile):
+    """
+    Return the most recent valid recorded run for profile, or None
+    """
+    previous = None
+    if not os.path.exists(history_path):
+        return None
+    with open(history_path, encoding="utf-8") as history_file:
+        for line in history_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("profile") == profile and not record.get("problems"):
+                previous = record
+    return previous
+
+
+def compare(previous, current, tolerance, min_delta_s=0.005):
+    """
+    Return (name, previous, current, change, regressed) rows for metrics present in both runs.
+    Timings that grew by less than min_delta_s are never regressions, so sub-millisecond
+    cache hits do not flag on scheduler noise.
+    """
+    rows = []
+    for name, value in sorted(current.items()):
+        old = previous.get(name)
+        if old is None or not name.endswith(REGRESSION_SUFFIXES):
+            continue
+        change = (value - old) / old if old else 0.0
+        regressed = change > tolerance and not (name.endswith("_s") and value - old < min_delta_s)
+        rows.append((name, old, value, change, regressed))
+    return rows
+
+
+def _format(name, value):
+    if name.endswith("_s"):
+        return f"{value * 1000:.1f} ms"
+    if name.endswith("_bytes"):
+        return f"{value / 1024:.1f} KiB"
+    return f"{value:g}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app end to end against local fake providers")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast", help="provider latency/error profile")
+    parser.add_argument("--specs", type=int, default=10, help="distinct design requests per phase")
+    parser.add_argument("--sessions", type=int, default=5, help="app sessions used to measure memory per session")
+    parser.add_argument("--seed", type=int, default=0, help="seed for fake provider latencies and errors")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSONL file runs are appended to")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown against the previous run reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    parser.add_argument("--skip-app", action="store_true", help="skip the Streamlit AppTest benchmarks")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    providers = start_fake_providers(args.profile, args.seed)
+    workdir = tempfile.mkdtemp(prefix="smarthome-bench-")
+    configure_environment(providers, workdir, unlimited=True)
+    sys.path.insert(0, REPO_ROOT)
+
+    specs = build_specs(args.specs)
+    metrics = {}
+    notes = []
+    try:
+        metrics.update(bench_design(specs))
+        metrics.update(bench_stream(specs))
+        metrics.update(bench_edits(dict(specs[0], style="Bauhaus")))
+        metrics.update(bench_fanout(specs))
+        metrics.update(bench_images(specs))
+        if args.skip_app:
+            notes.append("app benchmarks skipped (--skip-app)")
+        else:
+            try:
+                metrics.update(bench_app(dict(specs[0], style="Art Deco"), args.sessions))
+            except ImportError as e:
+                notes.append(f"app benchmarks skipped: {e}")
+    finally:
+        for provider in providers.values():
+            provider.stop()
+    for name, provider in providers.items():
+        metrics[f"provider.{name}.requests_count"] = provider.requests
+        metrics[f"provider.{name}.errors_count"] = provider.errors
+    metrics["process.max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    problems = run_problems(providers, args.profile)
+
+    record = {"ts": time.time(), "commit": _git_commit(), "profile": args.profile, "specs": args.specs,
+              "sessions": args.sessions, "seed": args.seed, "notes": notes, "problems": problems, "metrics": metrics}
+    previous = load_previous(args.history, args.profile)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "a", encoding="utf-8") as history_file:
+        history_file.write(json.dumps(record) + "\n")
+
+    print(f"Profile: {args.profile}   commit: {record['commit']}   specs: {args.specs}")
+    for note in notes:
+        print(f"Note: {note}")
+    for name, value in sorted(metrics.items()):
+        print(f"  {name:<70} {_format(name, value)}")
+
+    if problems:
+        # Recorded for reference, but never used as a baseline
+        for problem in problems:
+            print(f"INVALID RUN: {problem}")
+        sys.exit(1)
+
+    regressions = []
+    if previous is not None:
+        print(f"\nCompared with the previous {args.profile} run (commit {previous.get('commit')}):")
+        for name, old, value, change, regressed in compare(previous["metrics"], metrics, args.tolerance):
+            flag = "  REGRESSION" if regressed else ""
+            print(f"  {name:<45} {_format(name, old):>12} -> {_format(name, value):>12} ({change:+.0%}){flag}")
+            if regressed:
+                regressions.append(name)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from config import BLOB_STORE_MAX_BYTES, BLOB_STORE_PATH
+from metrics import inc, set_gauge
+
+logger = logging.getLogger(__name__)
+
+BLOB_REF_PREFIX = "blob:"
+
+
+def is_blob_ref(value):
+    """
+    True if value is a reference returned by BlobStore.put
+    """
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
+
+
+class BlobStore:
+    """
+    Content-addressed store for binary data (e.g. generated images) on local disk.
+
+    Blobs are keyed by the SHA-256 of their bytes, so identical images are stored
+    once no matter how many sessions or cache entries refer to them. Writes go
+    through a temporary file and an atomic rename, which makes concurrent puts of
+    the same blob from several processes safe.
+
+    Reads and repeated puts refresh a blob's mtime; when the store grows past
+    max_bytes the least recently used blobs are deleted. Cache entries may
+    outlive their blob, so callers check exists() before trusting a reference.
+    """
+
+    def __init__(self, root=BLOB_STORE_PATH, max_bytes=BLOB_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data):
+        """
+        Store data and return its reference ("blob:<sha256>")
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if self._touch(path):
+            return BLOB_REF_PREFIX + digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict(keep=path)
+        return BLOB_REF_PREFIX + digest
+
+    def _touch(self, path):
+        # Marks a blob as recently used (mtime, since atime is often not updated); False if it is missing
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def _evict(self, keep):
+        # Counts blob_evictions_total and exports blob_store_size_bytes
+        blobs = []
+        total = 0
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Deleted by another process meanwhile
+                blobs.append((stat.st_mtime, entry.path, stat.st_size))
+                total += stat.st_size
+        evicted = 0
+        if total > self.max_bytes:
+            for _, path, size in sorted(blobs):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+            inc("blob_evictions_total", evicted)
+            logger.info(f"Evicted {evicted} blobs to stay under {self.max_bytes} bytes")
+        set_gauge("blob_store_size_bytes", total)
+
+    def exists(self, ref):
+        return is_blob_ref(ref) and os.path.exists(self._path(ref[len(BLOB_REF_PREFIX):]))
+
+    def get(self, ref):
+        """
+        Return the bytes for a reference, or None if the blob is missing
+        """
+        if not is_blob_ref(ref):
+            return None
+        path = self._path(ref[len(BLOB_REF_PREFIX):])
+        try:
+            with open(path, "rb") as blob_file:
+                data = blob_file.read()
+            self._touch(path)
+            return data
+        except OSError as e:
+            logger.warning(f"Could not read blob {ref}: {e}")
+            return None
+
+
+blob_store = BlobStore()
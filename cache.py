@@ -0,0 +1,225 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import CACHE_MAX_BYTES, CACHE_PATH
+from metrics import inc, set_gauge
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at);
+"""
+
+
+class PersistentCache:
+    """
+    Disk-backed key/value cache stored in a local SQLite database.
+
+    Entries carry a TTL and a version string; a lookup whose version does not
+    match the stored one is a miss, so bumping a version (for example when a
+    prompt template changes) invalidates old entries. When the total stored
+    size exceeds max_bytes the least recently used entries are evicted.
+
+    The database runs in WAL mode with a busy timeout, so several Streamlit
+    worker processes on the same host can share one file. Each thread gets its
+    own connection.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key, version="1"):
+        """
+        Return the cached value, or None on a miss, expiry or version mismatch.
+        Counts cache_lookups_total by namespace and result (hit/miss).
+        """
+        conn = self._connection()
+        now = time.time()
+        try:
+            row = conn.execute(
+                "SELECT value, version, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                inc("cache_lookups_total", namespace=namespace, result="miss")
+                return None
+            value, stored_version, expires_at = row
+            if stored_version != version or expires_at < now:
+                conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                reason = "expired" if expires_at < now else "stale_version"
+                inc("cache_evictions_total", namespace=namespace, reason=reason)
+                inc("cache_lookups_total", namespace=namespace, result="miss")
+                return None
+            conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+            inc("cache_lookups_total", namespace=namespace, result="hit")
+            return json.loads(value)
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read failed for {namespace}: {e}")
+            return None
+
+    def set(self, namespace, key, value, ttl, version="1"):
+        """
+        Store a JSON-serializable value for ttl seconds
+        """
+        conn = self._connection()
+        now = time.time()
+        payload = json.dumps(value)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries "
+                    "(namespace, key, version, value, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (namespace, key, version, payload, len(payload), now + ttl, now),
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write failed for {namespace}: {e}")
+
+    def _evict(self, conn, now):
+        # Counts cache_evictions_total by namespace and reason (expired/size) and exports cache_size_bytes
+        expired = conn.execute(
+            "SELECT namespace, COUNT(*) FROM cache_entries WHERE expires_at < ? GROUP BY namespace", (now,)
+        ).fetchall()
+        if expired:
+            conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now,))
+            for namespace, count in expired:
+                inc("cache_evictions_total", count, namespace=namespace, reason="expired")
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            set_gauge("cache_size_bytes", total)
+            return
+        rows = conn.execute(
+            "SELECT namespace, key, size FROM cache_entries ORDER BY accessed_at ASC"
+        ).fetchall()
+        evicted = []
+        for namespace, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((namespace, key))
+            total -= size
+        conn.executemany(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", evicted
+        )
+        for namespace, _ in evicted:
+            inc("cache_evictions_total", namespace=namespace, reason="size")
+        set_gauge("cache_size_bytes", total)
+        logger.info(f"Evicted {len(evicted)} cache entries to stay under {self.max_bytes} bytes")
+
+    def delete(self, namespace, key):
+        """
+        Remove one entry if present
+        """
+        self._connection().execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key)
+        )
+
+    def clear(self, namespace=None):
+        """
+        Remove all entries, or only those in one namespace
+        """
+        conn = self._connection()
+        if namespace is None:
+            conn.execute("DELETE FROM cache_entries")
+        else:
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Return the process-wide PersistentCache, opening it on first use
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PersistentCache()
+    return _cache
+
+
+def make_key(*args, **kwargs):
+    """
+    Build a stable cache key from JSON-serializable call arguments
+    """
+    raw = json.dumps([args, kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def template_version(template):
+    """
+    Derive a short version string from a prompt template
+    """
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+def persistent_cache(namespace, ttl, version="1"):
+    """
+    Decorator caching a function's non-None results in the persistent cache.
+    Concurrent misses for the same key are coalesced into a single call.
+    """
+    def decorator(func):
+        flight = SingleFlight(namespace)
+
+        def load(key, args, kwargs):
+            result = func(*args, **kwargs)
+            if result is not None:
+                get_cache().set(namespace, key, result, ttl, version)
+            return result
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(*args, **kwargs)
+            cached = get_cache().get(namespace, key, version)
+            if cached is not None:
+                return cached
+            return flight.do(key, lambda: load(key, args, kwargs))
+        return wrapper
+    return decorator
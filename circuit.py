@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from config import (
+    CIRCUIT_ERROR_RATE,
+    CIRCUIT_MIN_CALLS,
+    CIRCUIT_OPEN_SECONDS,
+    CIRCUIT_SLOW_CALL_RATE,
+    CIRCUIT_SLOW_CALL_SECONDS,
+    CIRCUIT_WINDOW_SECONDS,
+)
+from metrics import inc, set_gauge
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CallPermit:
+    """
+    Handed out by CircuitBreaker.allow() for one call. Report the call's outcome
+    with record(), or release_probe() if it never went upstream.
+    """
+
+    __slots__ = ("breaker", "epoch")
+
+    def __init__(self, breaker, epoch):
+        self.breaker = breaker
+        self.epoch = epoch
+
+    def record(self, failed, latency):
+        self.breaker.record(failed, latency, self)
+
+    def release_probe(self):
+        self.breaker.release_probe(self)
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome and latency of recent calls to one upstream.
+
+    The breaker opens when, over the last window_seconds and at least min_calls
+    calls, the error rate reaches error_rate or the share of calls slower than
+    slow_call_seconds reaches slow_call_rate. While open, allow() returns False
+    so callers can fall back immediately. After open_seconds one probe call is
+    let through (half-open); its success closes the breaker, its failure
+    reopens it. Outcomes of calls let through before the latest state change
+    are ignored, so a slow call from before the breaker opened cannot be taken
+    for the probe. State changes are logged and exported as the circuit_state gauge
+    (0 closed, 1 half-open, 2 open).
+    """
+
+    def __init__(self, name, window_seconds=CIRCUIT_WINDOW_SECONDS, min_calls=CIRCUIT_MIN_CALLS,
+                 error_rate=CIRCUIT_ERROR_RATE, slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+                 slow_call_rate=CIRCUIT_SLOW_CALL_RATE, open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._calls = deque()  # (finished_at, failed, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._epoch = 0  # Incremented on every state change; permits carry the epoch they were issued in
+        set_gauge("circuit_state", _STATE_VALUES[CLOSED], breaker=name)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def _transition(self, state, reason=""):
+        if state == self._state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self._state} -> {state}{' (' + reason + ')' if reason else ''}")
+        self._state = state
+        self._epoch += 1
+        inc("circuit_transitions_total", breaker=self.name, state=state)
+        set_gauge("circuit_state", _STATE_VALUES[state], breaker=self.name)
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state == CLOSED:
+            self._calls.clear()
+
+    def allow(self):
+        """
+        Return a CallPermit if a call may go upstream now, otherwise None
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return CallPermit(self, self._epoch)
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN, "probing")
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return CallPermit(self, self._epoch)
+            inc("circuit_rejected_total", breaker=self.name)
+            return None
+
+    def record(self, failed, latency, permit):
+        """
+        Record the outcome of a call that allow() let through with permit
+        """
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if permit.epoch != self._epoch:
+                return
+            if self._state == HALF_OPEN:
+                # Only the probe is issued a permit while half-open
+                self._probe_in_flight = False
+                if failed or slow:
+                    self._transition(OPEN, "probe failed" if failed else "probe slow")
+                else:
+                    self._transition(CLOSED, "probe succeeded")
+                return
+            self._calls.append((now, failed, slow))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+            total = len(self._calls)
+            if self._state != CLOSED or total < self.min_calls:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if failures / total >= self.error_rate:
+                self._transition(OPEN, f"{failures}/{total} recent calls failed")
+            elif slow_calls / total >= self.slow_call_rate:
+                self._transition(OPEN, f"{slow_calls}/{total} recent calls slower than {self.slow_call_seconds}s")
+
+    def release_probe(self, permit):
+        """
+        Give up a half-open probe slot without recording an outcome
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and permit.epoch == self._epoch:
+                self._probe_in_flight = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """
+    Return the process-wide breaker for name (e.g. a Gemini model), creating it on first use
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
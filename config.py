@@ -6,6 +6,9 @@ load_dotenv()
 # API Configuration
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 STABILITY_AI_API_KEY = os.getenv("STABILITY_AI_API_KEY")
+# Alternative Gemini API endpoint, e.g. the local fakes in benchmarks/ (use with GEMINI_TRANSPORT=rest)
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT")  # "rest" or "grpc"; library default when unset
 
 # Model Configuration
 GENERATION_CONFIG = {
@@ -16,4 +19,100 @@ GENERATION_CONFIG = {
 }
 
 # Lexica API Configuration
-LEXICA_BASE_URL = "https://lexica.art/api/v1/search" 
\ No newline at end of file
+LEXICA_BASE_URL = os.getenv("LEXICA_BASE_URL", "https://lexica.art/api/v1/search")
+LEXICA_RESULT_LIMIT = int(os.getenv("LEXICA_RESULT_LIMIT", "10"))  # Results kept per style
+GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", "3"))  # Thumbnails per gallery page
+
+# Stability AI API Configuration
+STABILITY_API_HOST = os.getenv("STABILITY_API_HOST", "https://api.stability.ai")
+
+# HTTP Client Configuration (shared keep-alive connection pools)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))  # Connections kept per other host
+LEXICA_POOL_SIZE = int(os.getenv("LEXICA_POOL_SIZE", "10"))
+STABILITY_POOL_SIZE = int(os.getenv("STABILITY_POOL_SIZE", "10"))
+HTTP_REQUEST_WORKERS = int(os.getenv("HTTP_REQUEST_WORKERS", "16"))  # Threads running deadline-bounded requests
+
+# Image Request Deadlines (seconds; retries and hedges must fit inside the deadline)
+LEXICA_DEADLINE = float(os.getenv("LEXICA_DEADLINE", "8"))
+LEXICA_HEDGE_AFTER = float(os.getenv("LEXICA_HEDGE_AFTER", "1.5"))  # 0 disables hedging
+STABILITY_DEADLINE = float(os.getenv("STABILITY_DEADLINE", "45"))
+STABILITY_HEDGE_AFTER = float(os.getenv("STABILITY_HEDGE_AFTER", "0"))  # Off by default: hedges cost a generation
+
+# Design Generation Configuration
+STREAM_DESIGN_PLANS = os.getenv("STREAM_DESIGN_PLANS", "true").lower() == "true"
+# Ask Gemini for JSON plans parsed into typed records (not streamed); takes precedence over streaming
+STRUCTURED_DESIGN_PLANS = os.getenv("STRUCTURED_DESIGN_PLANS", "false").lower() == "true"
+# Structured plans cached per section, so an edit regenerates only the sections it affects; implies structured
+SECTIONED_DESIGN_PLANS = os.getenv("SECTIONED_DESIGN_PLANS", "false").lower() == "true"
+# Generate sections as concurrent calls, one per group (plan.SECTION_GROUPS); implies sectioned
+FANOUT_DESIGN_PLANS = os.getenv("FANOUT_DESIGN_PLANS", "false").lower() == "true"
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "4"))  # Section calls in flight across all sessions
+MAX_DESIGN_VARIANTS = int(os.getenv("MAX_DESIGN_VARIANTS", "4"))  # Plans compared side by side per submission
+# Output limit for structured plans and sections; a schema-complete JSON plan does not fit in GENERATION_CONFIG's
+STRUCTURED_MAX_OUTPUT_TOKENS = int(os.getenv("STRUCTURED_MAX_OUTPUT_TOKENS", "8192"))
+
+# Persistent Cache Configuration
+CACHE_PATH = os.getenv("CACHE_PATH", os.path.join(".cache", "smarthome_cache.sqlite3"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Request Log Configuration (JSONL of raw design requests; disabled when unset)
+REQUEST_LOG_PATH = os.getenv("REQUEST_LOG_PATH")
+
+# Background Work Configuration (shared by all sessions in the process)
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "8"))
+
+# Gemini models whose clients are created and connected at startup
+WARM_MODELS = [name.strip() for name in os.getenv("WARM_MODELS", "gemini-1.5-flash").split(",") if name.strip()]
+
+# Provider Rate Limits (shared by all sessions in the process)
+GEMINI_REQUESTS_PER_MIN = int(os.getenv("GEMINI_REQUESTS_PER_MIN", "15"))
+GEMINI_TOKENS_PER_MIN = int(os.getenv("GEMINI_TOKENS_PER_MIN", "1000000"))
+STABILITY_REQUESTS_PER_MIN = int(os.getenv("STABILITY_REQUESTS_PER_MIN", "60"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "20"))  # Waiting callers per provider
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))  # Seconds before degrading
+
+# Blob Store Configuration (decoded generated images, keyed by content hash)
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", os.path.join(".cache", "blobs"))
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))  # Least recently used evicted
+
+# Gemini Circuit Breaker (per model)
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))  # Recent calls considered
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))  # Calls needed before the breaker can open
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "30"))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))  # Time before a probe is let through
+
+# Semantic Cache (serves near-duplicate design requests from cache)
+# Opt-in until false hits are measured on real traffic
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))  # Min. similarity of requirements
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_DIMENSIONS = int(os.getenv("SEMANTIC_CACHE_DIMENSIONS", "512"))
+
+# Off-peak Cache Warmer (warmer.py)
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", "20"))  # Style/size/rooms combinations warmed per run
+WARM_LOOKBACK_DAYS = float(os.getenv("WARM_LOOKBACK_DAYS", "7"))  # Request log history considered
+WARM_QUIET_HOURS = os.getenv("WARM_QUIET_HOURS", "2-6")  # Local hours (start-end) when warming may run
+WARM_COMBINATIONS_PER_MIN = float(os.getenv("WARM_COMBINATIONS_PER_MIN", "4"))
+WARM_DESIGN_TTL = int(os.getenv("WARM_DESIGN_TTL", str(36 * 3600)))  # Warmed plans outlive the following day
+WARM_IMAGE_SOURCES = [s.strip() for s in os.getenv("WARM_IMAGE_SOURCES", "stability,lexica").split(",") if s.strip()]
+# Used when the request log is missing or has fewer than WARM_TOP_N combinations
+WARM_STYLES = [s.strip() for s in os.getenv(
+    "WARM_STYLES",
+    "Modern,Traditional,Contemporary,Rustic,Mediterranean,Colonial,Craftsman,Victorian,Minimalist,Industrial"
+).split(",") if s.strip()]
+WARM_SIZES = [s.strip() for s in os.getenv("WARM_SIZES", "2000 sq ft,1500 sq ft,3000 sq ft").split(",") if s.strip()]
+WARM_ROOMS = [s.strip() for s in os.getenv("WARM_ROOMS", "6").split(",") if s.strip()]
+
+# Metrics Endpoint (Prometheus text format at /metrics; port 0 disables it)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Debug Profiling (per-rerun phase timings in the sidebar and PROFILE_LOG_PATH)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLING = os.getenv("PROFILE_SAMPLING", "false").lower() == "true"  # Also sample CPU stacks
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # Seconds between stack samples
+PROFILE_LOG_PATH = os.getenv("PROFILE_LOG_PATH", os.path.join(".cache", "profile.jsonl"))
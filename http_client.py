@@ -0,0 +1,165 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    HTTP_REQUEST_WORKERS,
+    LEXICA_BASE_URL,
+    LEXICA_POOL_SIZE,
+    STABILITY_API_HOST,
+    STABILITY_POOL_SIZE,
+)
+from metrics import inc, observe
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+def _adapter(pool_size):
+    # Retries are handled by the callers, which know their own deadlines
+    return HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+
+
+def _build_session():
+    session = requests.Session()
+    session.mount("https://", _adapter(HTTP_POOL_SIZE))
+    session.mount("http://", _adapter(HTTP_POOL_SIZE))
+    # Dedicated, separately sized pools for the provider hosts
+    session.mount(_origin(LEXICA_BASE_URL), _adapter(LEXICA_POOL_SIZE))
+    session.mount(_origin(STABILITY_API_HOST), _adapter(STABILITY_POOL_SIZE))
+    return session
+
+
+def get_session():
+    """
+    Return the process-wide requests.Session.
+
+    Connections are kept alive and reused across calls and Streamlit sessions,
+    so only the first request to a host pays for the TCP and TLS handshakes.
+    The session carries no cookies or auth state, so it is shared by all threads.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+# Runs deadline-bounded attempts so the caller can stop waiting at the deadline;
+# separate from the app's background executor, whose tasks call into this module.
+_request_executor = ThreadPoolExecutor(max_workers=HTTP_REQUEST_WORKERS, thread_name_prefix="http")
+
+
+def _send(method, url, remaining, kwargs):
+    # One HTTP exchange, timed and counted by host and status code
+    host = urlsplit(url).netloc
+    timeout = (min(HTTP_CONNECT_TIMEOUT, remaining), min(HTTP_READ_TIMEOUT, remaining))
+    started_at = time.monotonic()
+    status = "error"
+    try:
+        response = get_session().request(method, url, timeout=timeout, **kwargs)
+        status = str(response.status_code)
+        response.raise_for_status()
+        return response
+    except requests.exceptions.Timeout:
+        status = "timeout"
+        raise
+    except requests.exceptions.ConnectionError:
+        status = "connection_error"
+        raise
+    finally:
+        observe("http_request_duration_seconds", time.monotonic() - started_at, host=host, method=method)
+        inc("http_responses_total", host=host, status=status)
+
+
+def _is_retryable(error):
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def _attempt(method, url, remaining, hedge_after, kwargs):
+    # One attempt, optionally hedged with a second identical request if the first is slow
+    futures = {_request_executor.submit(_send, method, url, remaining, kwargs)}
+    attempt_deadline = time.monotonic() + remaining
+    hedged = False
+    error = None
+    while futures:
+        timeout = attempt_deadline - time.monotonic()
+        if hedge_after and not hedged:
+            timeout = min(timeout, hedge_after)
+        done, futures = wait(futures, timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        if done:
+            continue
+        if hedge_after and not hedged and time.monotonic() < attempt_deadline:
+            hedged = True
+            inc("http_hedged_requests_total", host=urlsplit(url).netloc)
+            logger.info(f"Hedging slow request to {urlsplit(url).netloc} after {hedge_after:.1f}s")
+            futures.add(_request_executor.submit(
+                _send, method, url, attempt_deadline - time.monotonic(), kwargs
+            ))
+            continue
+        # Deadline reached; abandoned requests finish on their own socket timeouts
+        raise requests.exceptions.Timeout(f"Request to {url} exceeded its {remaining:.1f}s deadline")
+    raise error
+
+
+def request_with_deadline(method, url, deadline, max_attempts=3, backoff=0.5, hedge_after=None, before_attempt=None,
+                          **kwargs):
+    """
+    Send an HTTP request that returns or fails within deadline seconds overall.
+
+    Connection errors, timeouts and retryable statuses (429, 5xx) are retried up
+    to max_attempts times with full-jitter exponential backoff, as long as time
+    remains. With hedge_after set, an attempt that has not answered after that
+    many seconds gets a second, identical request and the first success wins.
+    before_attempt() is called before every attempt (not before hedges), e.g. to
+    take a provider rate-limit slot for each request sent; what it raises is
+    passed on. Raises the last error (requests.exceptions.Timeout once the deadline passes);
+    other HTTP errors are raised immediately.
+    """
+    host = urlsplit(url).netloc
+    deadline_at = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        attempt += 1
+        if before_attempt is not None:
+            before_attempt()
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout(f"Request to {url} exceeded its {deadline:.1f}s deadline")
+        try:
+            return _attempt(method, url, remaining, hedge_after, kwargs)
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= max_attempts:
+                raise
+            delay = random.uniform(0, backoff * 2 ** (attempt - 1))
+            if time.monotonic() + delay >= deadline_at:
+                raise
+            inc("http_retries_total", host=host)
+            logger.warning(f"Retrying request to {host} in {delay:.2f}s after attempt {attempt} failed: {e}")
+            time.sleep(delay)
@@ -0,0 +1,178 @@
+import logging
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) for latency histograms, from cache lookups to slow image generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}  # (name, labels) -> [per-bucket counts, sum, count]
+_histogram_buckets = {}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """
+    Add amount to a process-wide counter identified by name and labels
+    """
+    with _lock:
+        _counters[(name, _labels_key(labels))] += amount
+
+
+def set_gauge(name, value, **labels):
+    """
+    Set a process-wide gauge identified by name and labels
+    """
+    with _lock:
+        _gauges[(name, _labels_key(labels))] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """
+    Record value in a process-wide histogram identified by name and labels.
+    A histogram keeps the buckets it was first observed with.
+    """
+    with _lock:
+        buckets = _histogram_buckets.setdefault(name, tuple(buckets))
+        key = (name, _labels_key(labels))
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram[0][bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def get_counter(name, **labels):
+    """
+    Return the current value of a counter (0 if it was never incremented)
+    """
+    with _lock:
+        return _counters.get((name, _labels_key(labels)), 0)
+
+
+def snapshot():
+    """
+    Return a copy of all counters and gauges as {(name, ((label, value), ...)): value}
+    """
+    with _lock:
+        values = dict(_counters)
+        values.update(_gauges)
+        return values
+
+
+def record_token_usage(model_name, input_tokens, output_tokens, latency):
+    """
+    Record token counts and latency for one Gemini call
+    """
+    observe("gemini_request_duration_seconds", latency, model=model_name)
+    inc("gemini_requests_total", model=model_name)
+    inc("gemini_input_tokens_total", input_tokens, model=model_name)
+    inc("gemini_output_tokens_total", output_tokens, model=model_name)
+    inc("gemini_latency_seconds_total", latency, model=model_name)
+    logger.info(
+        f"Gemini call model={model_name} input_tokens={input_tokens} "
+        f"output_tokens={output_tokens} latency={latency:.2f}s"
+    )
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render_prometheus():
+    """
+    Return every counter, gauge and histogram in the Prometheus text exposition format
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: (list(counts), total, count) for key, (counts, total, count) in _histograms.items()}
+        buckets = dict(_histogram_buckets)
+
+    lines = []
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _ in values}):
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets[name]) + ["+Inf"], counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _format_number(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    Serve /metrics in the Prometheus text format from a daemon thread.
+    Safe to call repeatedly (e.g. on every Streamlit rerun); only the first call
+    starts the server. Returns the server, or None if disabled (port 0) or the
+    port is taken (e.g. by another worker process on the same host).
+    """
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+                _server = False
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            logger.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+        return _server or None
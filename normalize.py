@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+
+from config import REQUEST_LOG_PATH
+
+logger = logging.getLogger(__name__)
+
+SQM_TO_SQFT = 10.7639
+
+# A number counts as an area only with a unit or a "k" (thousands) suffix, so "2 story" or "3 acres" is not one
+_SIZE_PATTERN = re.compile(
+    r"(?P<number>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>k(?![a-z]))?\s*"
+    r"(?:(?P<metric>m2|m²|sqm|sq\.?\s*m(?:eters?|etres?)?|square\s+m(?:eters?|etres?))"
+    r"|(?P<imperial>sq\.?\s*f(?:ee)?t|sqft|square\s+f(?:ee|oo)t|ft²|ft2|sf))?(?![a-z])",
+    re.IGNORECASE,
+)
+
+_request_log_lock = threading.Lock()
+
+
+def _collapse(text):
+    return " ".join(str(text).split())
+
+
+def normalize_style(style):
+    """
+    Case-fold and trim a design style, e.g. " modern  FARMHOUSE" -> "Modern Farmhouse"
+    """
+    return _collapse(style).casefold().title()
+
+
+def size_bucket(sqft):
+    """
+    Round square footage to a bucket whose width grows with the home size
+    """
+    if sqft < 1000:
+        step = 100
+    elif sqft < 5000:
+        step = 250
+    else:
+        step = 500
+    return max(step, int(round(sqft / step)) * step)
+
+
+def normalize_size(size):
+    """
+    Parse a home size into a square footage bucket, e.g. "2,000 sqft" -> "2000 sq ft".
+    Only a size that is nothing but one number with an optional area unit (sq ft,
+    m², "2.5k") is bucketed; anything else (e.g. "2 story, 2500 sq ft",
+    "1500-2000 sq ft") is only trimmed, since the text also goes into the prompts.
+    """
+    text = _collapse(size)
+    match = _SIZE_PATTERN.fullmatch(text)
+    if not match:
+        return text
+    sqft = float(match.group("number").replace(",", ""))
+    if match.group("unit"):
+        sqft *= 1000
+    if match.group("metric"):
+        sqft *= SQM_TO_SQFT
+    return f"{size_bucket(sqft)} sq ft"
+
+
+def normalize_rooms(rooms):
+    """
+    Strip whitespace and leading zeros from a room count
+    """
+    text = _collapse(rooms)
+    return str(int(text)) if text.isdigit() else text
+
+
+def _is_empty(value):
+    return value is None or value == "" or value == [] or value == {}
+
+
+def _normalize_value(value):
+    if isinstance(value, str):
+        return _collapse(value)
+    if isinstance(value, (list, tuple, set)):
+        return sorted(_collapse(item) for item in value if not _is_empty(item))
+    if isinstance(value, dict):
+        normalized = {}
+        for key in sorted(value):
+            item = _normalize_value(value[key])
+            if not _is_empty(item):
+                normalized[key] = item
+        return normalized
+    return value
+
+
+def normalize_design_request(style, size, rooms, **kwargs):
+    """
+    Canonicalize a design request so that requests with the same meaning
+    produce the same prompt, and therefore the same cache entry.
+
+    Returns (style, size, rooms, kwargs). Room details and list values are put
+    in a fixed order and empty optional fields are dropped so the generator
+    falls back to its defaults for them.
+    """
+    normalized = {}
+    for key in sorted(kwargs):
+        value = _normalize_value(kwargs[key])
+        if not _is_empty(value):
+            normalized[key] = value
+    return normalize_style(style), normalize_size(size), normalize_rooms(rooms), normalized
+
+
+def log_request(style, size, rooms, **kwargs):
+    """
+    Append a raw design request to REQUEST_LOG_PATH, if request logging is enabled
+    """
+    if not REQUEST_LOG_PATH:
+        return
+    record = {"ts": time.time(), "style": style, "size": size, "rooms": rooms, "kwargs": kwargs}
+    try:
+        line = json.dumps(record, default=str)
+        with _request_log_lock, open(REQUEST_LOG_PATH, "a", encoding="utf-8") as log_file:
+            log_file.write(line + "\n")
+    except (OSError, TypeError) as e:
+        logger.warning(f"Could not write request log: {e}")
+
+
+def read_request_log(path):
+    """
+    Read request records written by log_request
+    """
+    records = []
+    with open(path, encoding="utf-8") as log_file:
+        for line in log_file:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def _request_key(style, size, rooms, kwargs):
+    return json.dumps([style, size, rooms, kwargs], sort_keys=True, default=str)
+
+
+def replay_hit_rate(records):
+    """
+    Replay logged requests against an unbounded exact-key cache and return the
+    hit rates with raw and with normalized keys
+    """
+    raw_keys = set()
+    normalized_keys = set()
+    raw_hits = normalized_hits = 0
+    for record in records:
+        kwargs = record.get("kwargs", {})
+        raw_key = _request_key(record["style"], record["size"], record["rooms"], kwargs)
+        style, size, rooms, normalized = normalize_design_request(
+            record["style"], record["size"], record["rooms"], **kwargs
+        )
+        normalized_key = _request_key(style, size, rooms, normalized)
+        raw_hits += raw_key in raw_keys
+        normalized_hits += normalized_key in normalized_keys
+        raw_keys.add(raw_key)
+        normalized_keys.add(normalized_key)
+    total = len(records)
+    return {
+        "requests": total,
+        "raw_hit_rate": raw_hits / total if total else 0.0,
+        "normalized_hit_rate": normalized_hits / total if total else 0.0,
+        "raw_unique": len(raw_keys),
+        "normalized_unique": len(normalized_keys),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report design-cache hit rates on a replayed request log")
+    parser.add_argument("log", nargs="?", default=REQUEST_LOG_PATH, help="JSONL request log")
+    args = parser.parse_args()
+    if not args.log:
+        parser.error("no request log given and REQUEST_LOG_PATH is not set")
+    report = replay_hit_rate(read_request_log(args.log))
+    print(f"Requests:            {report['requests']}")
+    print(f"Raw hit rate:        {report['raw_hit_rate']:.1%} ({report['raw_unique']} unique keys)")
+    print(f"Normalized hit rate: {report['normalized_hit_rate']:.1%} ({report['normalized_unique']} unique keys)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Plan sections in display order: (field, heading). "overview" is a paragraph,
+# "rooms" and "materials" are lists of records, every other section a list of points.
+SECTIONS = (
+    ("overview", "Overall Layout and Floor Plan"),
+    ("rooms", "Room-by-Room Breakdown"),
+    ("architectural_features", "Architectural Features and Design Elements"),
+    ("color_scheme", "Color Scheme"),
+    ("materials", "Materials"),
+    ("lighting", "Lighting and Electrical"),
+    ("furniture", "Furniture and Decor"),
+    ("outdoor", "Outdoor Spaces"),
+    ("energy_efficiency", "Energy Efficiency"),
+    ("timeline_budget", "Timeline and Budget"),
+    ("doors_windows", "Door and Window Placement"),
+    ("storage", "Storage and Organization"),
+    ("accessibility", "Accessibility"),
+    ("smart_home", "Smart Home Integration"),
+    ("maintenance", "Maintenance"),
+)
+POINT_SECTIONS = tuple(field for field, _ in SECTIONS if field not in ("overview", "rooms", "materials"))
+
+# Request inputs each section is written from, on top of SECTION_COMMON_INPUTS.
+# A section is only regenerated when one of its inputs changes (see utils.generate_sectioned_plan).
+SECTION_COMMON_INPUTS = ("style", "additional_requirements")  # free-text requirements can touch any section
+SECTION_INPUTS = {
+    "overview": ("size", "rooms", "num_bedrooms", "num_bathrooms", "priority"),
+    "rooms": ("size", "rooms", "num_bedrooms", "num_bathrooms", "ceiling_height", "room_details"),
+    "architectural_features": ("size", "ceiling_height", "num_doors", "num_windows"),
+    "color_scheme": ("floor_material", "room_details"),
+    "materials": ("floor_material", "ceiling_height", "priority"),
+    "lighting": ("rooms", "num_windows", "ceiling_height", "room_details"),
+    "furniture": ("rooms", "floor_material", "room_details"),
+    "outdoor": ("size", "num_doors"),
+    "energy_efficiency": ("size", "num_windows", "ceiling_height", "priority"),
+    "timeline_budget": ("size", "rooms", "floor_material", "timeline", "priority"),
+    "doors_windows": ("num_doors", "num_windows", "ceiling_height"),
+    "storage": ("rooms", "num_bedrooms", "room_details"),
+    "accessibility": ("size", "num_bathrooms", "num_doors"),
+    "smart_home": ("rooms", "priority"),
+    "maintenance": ("floor_material", "timeline", "priority"),
+}
+
+
+def section_inputs(field):
+    return SECTION_COMMON_INPUTS + SECTION_INPUTS[field]
+
+
+# Related sections generated by one call when plans are fanned out (FANOUT_DESIGN_PLANS)
+SECTION_GROUPS = (
+    ("overview", "rooms", "architectural_features", "doors_windows"),
+    ("color_scheme", "materials", "lighting", "furniture"),
+    ("outdoor", "energy_efficiency", "accessibility", "smart_home"),
+    ("timeline_budget", "storage", "maintenance"),
+)
+
+
+def section_groups(fields):
+    """
+    Split fields into the non-empty parts of SECTION_GROUPS
+    """
+    groups = [tuple(field for field in group if field in fields) for group in SECTION_GROUPS]
+    return [group for group in groups if group]
+
+
+class Room:
+    __slots__ = ("name", "dimensions", "purpose", "features")
+
+    def __init__(self, name, dimensions="", purpose="", features=()):
+        self.name = name
+        self.dimensions = dimensions
+        self.purpose = purpose
+        self.features = tuple(features)
+
+    def to_dict(self):
+        return {"name": self.name, "dimensions": self.dimensions, "purpose": self.purpose,
+                "features": list(self.features)}
+
+    def to_markdown(self):
+        line = f"*   **{self.name}**"
+        if self.dimensions:
+            line += f" ({self.dimensions})"
+        if self.purpose:
+            line += f": {self.purpose}"
+        return "\n".join([line] + [f"    *   {feature}" for feature in self.features])
+
+
+class Material:
+    __slots__ = ("name", "use")
+
+    def __init__(self, name, use=""):
+        self.name = name
+        self.use = use
+
+    def to_dict(self):
+        return {"name": self.name, "use": self.use}
+
+    def to_markdown(self):
+        return f"*   **{self.name}**" + (f": {self.use}" if self.use else "")
+
+
+class DesignPlan:
+    """
+    A design plan as typed records rather than Markdown.
+
+    Plans are built from Gemini's schema-constrained JSON (see PLAN_SCHEMA),
+    cached as plain dicts via to_dict(), and only rendered with to_markdown()
+    when displayed or downloaded. List fields are tuples, so plans are cheap
+    to keep in session state.
+    """
+
+    __slots__ = ("title", "overview", "rooms", "materials") + POINT_SECTIONS
+
+    def __init__(self, title, overview="", rooms=(), materials=(), **points):
+        self.title = title
+        self.overview = overview
+        self.rooms = tuple(rooms)
+        self.materials = tuple(materials)
+        for field in POINT_SECTIONS:
+            setattr(self, field, tuple(points.get(field, ())))
+
+    def to_dict(self):
+        data = {"title": self.title, "overview": self.overview,
+                "rooms": [room.to_dict() for room in self.rooms],
+                "materials": [material.to_dict() for material in self.materials]}
+        for field in POINT_SECTIONS:
+            data[field] = list(getattr(self, field))
+        return data
+
+    def section_markdown(self, field):
+        """
+        Render one section's body (without its heading)
+        """
+        if field == "overview":
+            return self.overview
+        return "\n".join(_item_markdown(item) for item in getattr(self, field))
+
+    def to_markdown(self):
+        parts = [f"# {self.title}"]
+        for number, (field, heading) in enumerate(SECTIONS, start=1):
+            body = self.section_markdown(field)
+            if body:
+                parts.append(f"### {number}. {heading}\n{body}")
+        return "\n\n".join(parts) + "\n"
+
+
+def _item_markdown(item):
+    return f"*   {item}" if isinstance(item, str) else item.to_markdown()
+
+
+def _text(value):
+    return " ".join(str(value).split()) if value is not None else ""
+
+
+def _texts(values):
+    if not isinstance(values, list):
+        raise ValueError(f"expected a list, got {type(values).__name__}")
+    return [text for text in (_text(value) for value in values) if text]
+
+
+def load_section(field, value):
+    """
+    Build one section's value (text, records or points) from its JSON form, raising ValueError if malformed
+    """
+    try:
+        if field == "overview":
+            return _text(value)
+        if field == "rooms":
+            return tuple(Room(_text(room["name"]), _text(room.get("dimensions")), _text(room.get("purpose")),
+                              _texts(room.get("features", [])))
+                         for room in value)
+        if field == "materials":
+            return tuple(Material(_text(material["name"]), _text(material.get("use"))) for material in value)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"malformed {field}: {e}") from e
+    return tuple(_texts(value))
+
+
+def dump_section(field, value):
+    """
+    The JSON form of one section's value, as cached
+    """
+    if field == "overview":
+        return value
+    return [item if isinstance(item, str) else item.to_dict() for item in value]
+
+
+def plan_from_dict(data):
+    """
+    Build a DesignPlan from a parsed JSON plan, raising ValueError if it does not fit the schema
+    """
+    if not isinstance(data, dict):
+        raise ValueError("plan must be a JSON object")
+    if not _text(data.get("title")) or not _text(data.get("overview")):
+        raise ValueError("plan needs a title and an overview")
+    sections = {field: load_section(field, data.get(field, [])) for field, _ in SECTIONS if field != "overview"}
+    return DesignPlan(_text(data["title"]), _text(data["overview"]), **sections)
+
+
+def parse_sections(text, fields):
+    """
+    Parse a JSON response holding the given sections into {field: value}, raising ValueError if any is missing
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"sections are not valid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("sections must be a JSON object")
+    missing = [field for field in fields if field not in data]
+    if missing:
+        raise ValueError(f"missing sections: {', '.join(missing)}")
+    sections = {field: load_section(field, data[field]) for field in fields}
+    if "overview" in sections and not sections["overview"]:
+        raise ValueError("overview is empty")
+    return sections
+
+
+def parse_plan(text):
+    """
+    Parse Gemini's JSON response into a DesignPlan, raising ValueError on invalid JSON or shape
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"plan is not valid JSON: {e}") from e
+    return plan_from_dict(data)
+
+
+def plan_markdown(plan):
+    """
+    Markdown for a plan that may be a DesignPlan or an already rendered string
+    """
+    return plan.to_markdown() if isinstance(plan, DesignPlan) else plan
+
+
+def _string_list(description):
+    return {"type": "ARRAY", "items": {"type": "STRING"}, "description": description}
+
+
+# Response schema for Gemini's structured output (OpenAPI subset used by the API)
+PLAN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING", "description": "Short plan title naming the style"},
+        "overview": {"type": "STRING", "description": "One paragraph describing the overall layout and floor plan"},
+        "rooms": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "dimensions": {"type": "STRING", "description": "e.g. 14ft x 16ft"},
+                    "purpose": {"type": "STRING"},
+                    "features": {"type": "ARRAY", "items": {"type": "STRING"}},
+                },
+                "required": ["name", "dimensions", "purpose"],
+            },
+        },
+        "materials": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "use": {"type": "STRING", "description": "Where and why it is used"},
+                },
+                "required": ["name", "use"],
+            },
+        },
+        **{field: _string_list(heading) for field, heading in SECTIONS if field in POINT_SECTIONS},
+    },
+    "required": [field for field, _ in SECTIONS] + ["title"],
+}
+
+
+def section_schema(fields):
+    """
+    Response schema asking for only the given sections
+    """
+    return {
+        "type": "OBJECT",
+        "properties": {field: PLAN_SCHEMA["properties"][field] for field in fields},
+        "required": list(fields),
+    }
@@ -0,0 +1,233 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import PROFILE_LOG_PATH, PROFILE_SAMPLE_INTERVAL, PROFILE_SAMPLING, PROFILING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# The profile of the rerun being executed; copied into background tasks by utils.submit_background
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+_log_lock = threading.Lock()
+
+
+class StackSampler:
+    """
+    Sampling CPU profiler: every interval seconds it records the Python stack of
+    each watched thread. Functions are ranked by the share of samples in which
+    they are on the stack (cumulative) or at the top of it (self).
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.cumulative = Counter()
+        self.own = Counter()
+        self._thread_ids = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def watch(self, thread_id):
+        with self._lock:
+            self._thread_ids.add(thread_id)
+
+    def unwatch(self, thread_id):
+        with self._lock:
+            self._thread_ids.discard(thread_id)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                thread_ids = list(self._thread_ids)
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                self.samples += 1
+                self.own[_frame_label(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    label = _frame_label(frame)
+                    if label not in seen:
+                        seen.add(label)
+                        self.cumulative[label] += 1
+                    frame = frame.f_back
+
+    def top(self, limit=15):
+        """
+        Return [(function, cumulative share, self share)] for the most sampled functions
+        """
+        total = self.samples or 1
+        return [(label, count / total, self.own[label] / total) for label, count in self.cumulative.most_common(limit)]
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class RerunProfile:
+    """
+    Timings for one script run: consecutive phases marked with lap() and calls
+    to profiled functions, which may happen on background threads.
+    """
+
+    def __init__(self, sampling=PROFILE_SAMPLING):
+        self.started_at = time.perf_counter()
+        self.total = None
+        self.phases = []  # (name, seconds)
+        self.calls = {}  # name -> (count, seconds)
+        self._last_lap = self.started_at
+        self._lock = threading.Lock()
+        self.thread_id = threading.get_ident()
+        self.sampler = StackSampler() if sampling else None
+        if self.sampler is not None:
+            self.sampler.watch(self.thread_id)
+            self.sampler.start()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last_lap))
+        self._last_lap = now
+
+    def record_call(self, name, seconds):
+        with self._lock:
+            count, total = self.calls.get(name, (0, 0.0))
+            self.calls[name] = (count + 1, total + seconds)
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started_at
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def to_dict(self):
+        record = {
+            "ts": time.time(),
+            "total": self.total,
+            "phases": [{"name": name, "seconds": seconds} for name, seconds in self.phases],
+            "calls": {name: {"count": count, "seconds": seconds} for name, (count, seconds) in self.calls.items()},
+        }
+        if self.sampler is not None:
+            record["samples"] = self.sampler.samples
+            record["top_functions"] = [
+                {"function": label, "cumulative": cumulative, "self": own}
+                for label, cumulative, own in self.sampler.top()
+            ]
+        return record
+
+
+def start_rerun():
+    """
+    Begin profiling the current script run and return its RerunProfile, or None when profiling is off
+    """
+    if not PROFILING_ENABLED:
+        return None
+    profile = RerunProfile()
+    _current_profile.set(profile)
+    return profile
+
+
+def finish_rerun(profile):
+    """
+    Stop profiling a run and append it to PROFILE_LOG_PATH as one JSON line
+    """
+    if profile is None:
+        return
+    profile.finish()
+    _current_profile.set(None)
+    if not PROFILE_LOG_PATH:
+        return
+    try:
+        line = json.dumps(profile.to_dict())
+        os.makedirs(os.path.dirname(os.path.abspath(PROFILE_LOG_PATH)), exist_ok=True)
+        with _log_lock, open(PROFILE_LOG_PATH, "a", encoding="utf-8") as log_file:
+            log_file.write(line + "\n")
+    except OSError as e:
+        logger.warning(f"Could not write profile log: {e}")
+
+
+def lap(name):
+    """
+    Attribute the time since the previous lap (or the start of the run) to the phase name.
+    Only a flag check when profiling is off.
+    """
+    if not PROFILING_ENABLED:
+        return
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.lap(name)
+
+
+def profiled(func):
+    """
+    Decorator recording each call's wall time in the current run's profile.
+    Generators are timed until exhausted. Returns func itself when profiling is
+    off, so disabled profiling costs nothing per call.
+    """
+    if not PROFILING_ENABLED:
+        return func
+    name = func.__name__
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            profile, watched = _start_call()
+            started_at = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            finally:
+                _end_call(profile, watched, name, started_at)
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile, watched = _start_call()
+        started_at = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _end_call(profile, watched, name, started_at)
+    return wrapper
+
+
+def _start_call():
+    # Calls on background threads are sampled too, for as long as they run
+    profile = _current_profile.get()
+    watched = None
+    if profile is not None and profile.sampler is not None and threading.get_ident() != profile.thread_id:
+        watched = threading.get_ident()
+        profile.sampler.watch(watched)
+    return profile, watched
+
+
+def _end_call(profile, watched, name, started_at):
+    if profile is None:
+        return
+    profile.record_call(name, time.perf_counter() - started_at)
+    if watched is not None:
+        profile.sampler.unwatch(watched)
+
+
+def bind_context(func):
+    """
+    Wrap func so it runs with the caller's current profile, e.g. on an executor thread
+    """
+    if not PROFILING_ENABLED:
+        return func
+    return functools.partial(contextvars.copy_context().run, func)
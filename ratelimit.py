@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from config import (
+    ADMISSION_MAX_WAIT,
+    ADMISSION_QUEUE_SIZE,
+    GEMINI_REQUESTS_PER_MIN,
+    GEMINI_TOKENS_PER_MIN,
+    STABILITY_REQUESTS_PER_MIN,
+)
+
+from metrics import inc, observe
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a provider call cannot be admitted within its wait budget"""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_min, holding at most rate_per_min tokens.
+    Not thread-safe on its own; ProviderLimiter serializes access.
+    """
+
+    def __init__(self, rate_per_min):
+        self.capacity = float(rate_per_min)
+        self.rate = rate_per_min / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount):
+        """
+        Seconds until amount tokens are available (0 if they are available now)
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class ProviderLimiter:
+    """
+    Process-wide admission control for one provider.
+
+    Callers queue in FIFO order; the head of the queue is admitted once both the
+    requests/min and (optionally) tokens/min buckets can cover it. Callers are
+    rejected with AdmissionRejected when the queue is already full or when they
+    cannot be admitted within max_wait seconds.
+    """
+
+    def __init__(self, name, requests_per_min, tokens_per_min=None,
+                 max_queue=ADMISSION_QUEUE_SIZE, max_wait=ADMISSION_MAX_WAIT):
+        self.name = name
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._requests = TokenBucket(requests_per_min)
+        self._tokens = TokenBucket(tokens_per_min) if tokens_per_min else None
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    def queue_length(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _wait_time(self, tokens):
+        wait = self._requests.time_until(1)
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.time_until(tokens))
+        return wait
+
+    def acquire(self, tokens=0, on_wait=None):
+        """
+        Block until this call is admitted.
+
+        on_wait(provider_name, position) is called whenever the caller's 1-based
+        queue position changes while it is waiting, and with position 0 when a
+        caller that was told its position leaves the queue (admitted or not).
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.max_wait
+        ticket = object()
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                inc("admission_rejected_total", provider=self.name, reason="queue_full")
+                logger.warning(f"{self.name} admission queue is full ({self.max_queue}); rejecting request")
+                raise AdmissionRejected(f"{self.name} is at capacity, please try again shortly")
+            self._queue.append(ticket)
+
+        last_position = None
+        try:
+            while True:
+                with self._cond:
+                    position = self._queue.index(ticket) + 1
+                    wait = self._wait_time(tokens) if position == 1 else self.max_wait
+                    if position == 1 and wait <= 0:
+                        self._requests.take(1)
+                        if self._tokens is not None:
+                            self._tokens.take(tokens)
+                        observe("admission_wait_seconds", time.monotonic() - started_at, provider=self.name)
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        inc("admission_rejected_total", provider=self.name, reason="timeout")
+                        logger.warning(f"{self.name} request not admitted within {self.max_wait}s")
+                        raise AdmissionRejected(f"{self.name} is busy, please try again shortly")
+                    if position == last_position:
+                        self._cond.wait(min(wait, remaining, 1.0))
+                        continue
+                if on_wait is not None:
+                    on_wait(self.name, position)
+                last_position = position
+        finally:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                self._cond.notify_all()
+            if on_wait is not None and last_position is not None:
+                on_wait(self.name, 0)
+
+
+def estimate_gemini_tokens(prompt, max_output_tokens):
+    """
+    Conservative token estimate for admission: ~4 characters per input token plus the full output budget
+    """
+    return len(prompt) // 4 + max_output_tokens
+
+
+gemini_limiter = ProviderLimiter("Gemini", GEMINI_REQUESTS_PER_MIN, GEMINI_TOKENS_PER_MIN)
+stability_limiter = ProviderLimiter("Stability AI", STABILITY_REQUESTS_PER_MIN)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from config import (
+    SEMANTIC_CACHE_DIMENSIONS,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+from metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Free-text fields compared by similarity; the style must match as a set of words and every other field exactly
+TEXT_FIELDS = ("additional_requirements",)
+
+_STOPWORDS = frozenset({"a", "an", "and", "the", "with", "for", "of", "to", "in", "on", "style", "please", "want", "need"})
+_NEGATIONS = frozenset({"no", "not", "without", "avoid"})
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text):
+    negate = False
+    for word in _WORD_PATTERN.findall(str(text).casefold()):
+        if word in _NEGATIONS:
+            negate = True
+            continue
+        if word in _STOPWORDS:
+            continue
+        # Cheap plural folding so "windows"/"window" match
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        # "no basement" must not look like "basement"
+        yield f"not_{word}" if negate else word
+        negate = False
+
+
+def embed(kwargs, dimensions=SEMANTIC_CACHE_DIMENSIONS):
+    """
+    Turn the free-text requirements of a normalized spec into an L2-normalized
+    hashed bag-of-words vector (all zeros when there are none). Word order is
+    ignored, so "home office, natural light" and "natural light home office"
+    embed identically.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for name in TEXT_FIELDS:
+        for token in _tokens(kwargs.get(name, "")):
+            vector[zlib.crc32(f"{name}:{token}".encode("utf-8")) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def guard_key(model_name, style, size, rooms, kwargs):
+    """
+    64-bit id of the exact-match part of a spec: the style's set of words, every
+    structured field, and whether each free-text field is filled in at all, so a
+    request with requirements never matches one without
+    """
+    structured = {key: value for key, value in kwargs.items() if key not in TEXT_FIELDS}
+    filled = [any(True for _ in _tokens(kwargs.get(name, ""))) for name in TEXT_FIELDS]
+    raw = json.dumps([model_name, sorted(set(_tokens(style))), size, rooms, structured, filled],
+                     sort_keys=True, default=str)
+    return int.from_bytes(hashlib.sha256(raw.encode("utf-8")).digest()[:8], "little", signed=True)
+
+
+class SemanticIndex:
+    """
+    In-memory nearest-neighbour index over past design requests.
+
+    Each entry pairs the embedding of a normalized spec's requirements text with
+    the exact-match guard of its style and structured fields and the design
+    cache key that holds its plan. A lookup returns the cache key of the most
+    similar entry with the same guard, if the cosine similarity of the
+    requirements alone reaches the threshold. Vectors
+    live in one preallocated matrix, so a lookup is a single matrix-vector
+    product; when full, the oldest entries are overwritten.
+    """
+
+    def __init__(self, max_entries=SEMANTIC_CACHE_MAX_ENTRIES, dimensions=SEMANTIC_CACHE_DIMENSIONS,
+                 threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self._guards = np.zeros(max_entries, dtype=np.int64)
+        self._cache_keys = [None] * max_entries
+        self._next = 0
+        self._size = 0
+
+    def add(self, model_name, style, size, rooms, kwargs, cache_key):
+        vector = embed(kwargs, self.dimensions)
+        guard = guard_key(model_name, style, size, rooms, kwargs)
+        with self._lock:
+            slot = self._next
+            self._vectors[slot] = vector
+            self._guards[slot] = guard
+            self._cache_keys[slot] = cache_key
+            self._next = (slot + 1) % len(self._cache_keys)
+            self._size = min(self._size + 1, len(self._cache_keys))
+
+    def nearest(self, model_name, style, size, rooms, kwargs):
+        """
+        Return (cache_key, similarity) of the closest entry with the same guard, or (None, 0.0)
+        """
+        vector = embed(kwargs, self.dimensions)
+        guard = guard_key(model_name, style, size, rooms, kwargs)
+        with self._lock:
+            if not self._size:
+                return None, 0.0
+            candidates = np.flatnonzero(self._guards[:self._size] == guard)
+            if not candidates.size:
+                return None, 0.0
+            if not vector.any():
+                # No requirements on either side (the guard checks), so the specs are equivalent
+                return self._cache_keys[candidates[-1]], 1.0
+            similarities = self._vectors[candidates] @ vector
+            best = int(np.argmax(similarities))
+            return self._cache_keys[candidates[best]], float(similarities[best])
+
+    def lookup(self, model_name, style, size, rooms, kwargs):
+        """
+        Return the cache key of a near-duplicate request above the threshold, or None.
+        Counts semantic_cache_lookups_total by result (hit/miss).
+        """
+        cache_key, similarity = self.nearest(model_name, style, size, rooms, kwargs)
+        if cache_key is not None and similarity >= self.threshold:
+            inc("semantic_cache_lookups_total", result="hit")
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f}) for style {style!r}")
+            return cache_key
+        inc("semantic_cache_lookups_total", result="miss")
+        return None
+
+
+def evaluate_threshold(labeled_pairs, thresholds, model_name="gemini-1.5-flash"):
+    """
+    Measure hit and false-hit rates for candidate thresholds.
+
+    labeled_pairs is a list of (spec_a, spec_b, same_meaning), each spec a
+    normalized (style, size, rooms, kwargs) tuple. Returns
+    {threshold: {"hit_rate", "false_hit_rate"}}, where hit_rate is the share of
+    same-meaning pairs served from cache and false_hit_rate the share of
+    different-meaning pairs that would wrongly be served.
+    """
+    scores = []
+    for spec_a, spec_b, same in labeled_pairs:
+        index = SemanticIndex(max_entries=1)
+        index.add(model_name, *spec_a, cache_key="a")
+        cache_key, similarity = index.nearest(model_name, *spec_b)
+        scores.append((similarity if cache_key else 0.0, same))
+    positives = sum(1 for _, same in scores if same) or 1
+    negatives = sum(1 for _, same in scores if not same) or 1
+    return {
+        threshold: {
+            "hit_rate": sum(1 for s, same in scores if same and s >= threshold) / positives,
+            "false_hit_rate": sum(1 for s, same in scores if not same and s >= threshold) / negatives,
+        }
+        for threshold in thresholds
+    }
+
+
+semantic_index = SemanticIndex() if SEMANTIC_CACHE_ENABLED else None
@@ -0,0 +1,77 @@
+import threading
+
+from metrics import inc
+
+
+class FlightAbandoned(Exception):
+    """Raised to followers when the leader stopped without producing a result"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller (the leader)
+    does the work and every caller that arrives while it is running waits for
+    and shares its result instead of making its own upstream request.
+
+    Counters singleflight_leader_total and singleflight_coalesced_total (labelled
+    by group) record upstream calls made and saved.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def begin(self, key):
+        """
+        Join the flight for key. Returns (is_leader, call); the leader must later
+        call finish(key, call, ...), followers call call.wait().
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                inc("singleflight_coalesced_total", group=self.name)
+                return False, call
+            call = _Call()
+            self._calls[key] = call
+        inc("singleflight_leader_total", group=self.name)
+        return True, call
+
+    def finish(self, key, call, result=None, error=None):
+        """
+        Publish the leader's result (or exception) to waiting followers
+        """
+        call.result = result
+        call.error = error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def do(self, key, func):
+        """
+        Run func() once for all concurrent callers with the same key
+        """
+        is_leader, call = self.begin(key)
+        if not is_leader:
+            return call.wait()
+        try:
+            result = func()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
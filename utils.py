@@ -1,114 +1,759 @@
+import base64
+import contextvars
+import functools
+import hashlib
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import google.generativeai as genai
-from config import GOOGLE_API_KEY, GENERATION_CONFIG, LEXICA_BASE_URL, STABILITY_AI_API_KEY
-import streamlit as st
-from tenacity import retry, wait_exponential, stop_after_attempt, after_log
+from PIL import Image
+from config import (BACKGROUND_WORKERS, FANOUT_CONCURRENCY, FANOUT_DESIGN_PLANS, SECTIONED_DESIGN_PLANS, STRUCTURED_DESIGN_PLANS, GEMINI_API_ENDPOINT, GEMINI_TRANSPORT, GOOGLE_API_KEY, GENERATION_CONFIG, LEXICA_BASE_URL, STABILITY_AI_API_KEY, WARM_MODELS,
+                    GALLERY_PAGE_SIZE, LEXICA_DEADLINE, LEXICA_HEDGE_AFTER, LEXICA_RESULT_LIMIT, STABILITY_API_HOST,
+                    STABILITY_DEADLINE, STABILITY_HEDGE_AFTER, STRUCTURED_MAX_OUTPUT_TOKENS)
+from blobstore import blob_store, is_blob_ref
+from cache import get_cache, make_key, persistent_cache, template_version
+from http_client import request_with_deadline
+from circuit import get_breaker
+from metrics import inc, observe, record_token_usage
+from ratelimit import AdmissionRejected, estimate_gemini_tokens, gemini_limiter, stability_limiter
+from semantic_cache import semantic_index
+from singleflight import FlightAbandoned, SingleFlight
+from profiling import bind_context, profiled
+from plan import (PLAN_SCHEMA, SECTIONS, DesignPlan, dump_section, load_section, parse_plan, parse_sections,
+                  plan_from_dict, section_groups, section_inputs, section_schema)
+from normalize import normalize_design_request, normalize_size, normalize_style, normalize_rooms
 import logging
 
 # Configure Google AI
-genai.configure(api_key=GOOGLE_API_KEY)
+_genai_options = {}
+if GEMINI_TRANSPORT:
+    _genai_options["transport"] = GEMINI_TRANSPORT
+if GEMINI_API_ENDPOINT:
+    _genai_options["client_options"] = {"api_endpoint": GEMINI_API_ENDPOINT}
+genai.configure(api_key=GOOGLE_API_KEY, **_genai_options)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-@st.cache_data(ttl=3600)  # Cache for 1 hour
-def generate_design_idea(style, size, rooms, model_name="gemini-1.5-flash", **kwargs):
-    """
-    Generate custom home design plan using Google's Gemini AI
-    """
-    # Extract additional parameters from kwargs
-    room_details = kwargs.get('room_details', {})
-    num_bedrooms = kwargs.get('num_bedrooms', 3)
-    num_bathrooms = kwargs.get('num_bathrooms', 2)
-    num_doors = kwargs.get('num_doors', 2)
-    num_windows = kwargs.get('num_windows', 8)
-    ceiling_height = kwargs.get('ceiling_height', 'Standard (8ft)')
-    floor_material = kwargs.get('floor_material', 'Hardwood')
-    additional_requirements = kwargs.get('additional_requirements', '')
-    timeline = kwargs.get('timeline', 'Not specified')
-    priority = kwargs.get('priority', 'Not specified')
-    
-    # Context for the AI model
-    context = f"""
-    You are an expert home designer and architect. Create a comprehensive custom home design plan with the following specifications:
+# Bounded pool for provider calls that run alongside the session thread
+_background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="smarthome")
+
+def submit_background(func, *args, **kwargs):
+    """
+    Run func on the shared background executor and return its Future.
+    The task inherits the caller's profiling context.
+    """
+    return _background_executor.submit(bind_context(func), *args, **kwargs)
+
+# Section group calls of fanned-out plans; its size is the shared limit on their concurrency.
+# Separate from the background pool, whose tasks wait on these.
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_CONCURRENCY, thread_name_prefix="smarthome-fanout")
+
+def _instrumented(provider):
+    """
+    Time calls that reach a provider and count them by outcome: ok, failed (returned None) or error
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = time.monotonic()
+            outcome = "error"
+            try:
+                result = func(*args, **kwargs)
+                outcome = "ok" if result is not None else "failed"
+                return result
+            finally:
+                observe("provider_request_duration_seconds", time.monotonic() - started_at,
+                        provider=provider, outcome=outcome)
+                inc("provider_requests_total", provider=provider, outcome=outcome)
+        return wrapper
+    return decorator
+
+# Concurrent identical design requests share one Gemini call, keyed like the cache
+_design_flight = SingleFlight("design")
+_plan_flight = SingleFlight("design_plan")
+_sections_flight = SingleFlight("design_sections")
+
+# Finished design plans, shared by the blocking and streaming generators
+DESIGN_CACHE_TTL = 3600  # Cache for 1 hour
+IMAGE_CACHE_TTL = 86400  # Cache for 24 hours
+
+# What the app's detailed planning form sends when left untouched. app.main takes its
+# widget defaults from here, and warmer.py warms requests with these values.
+FORM_DEFAULTS = {
+    "room_details": {
+        "living_room": {"size": "", "layout": "Open", "features": []},
+        "kitchen": {"size": "", "layout": "Open", "features": []},
+        "master_bedroom": {"size": "", "features": []},
+    },
+    "num_bedrooms": 3,
+    "num_bathrooms": 2,
+    "num_doors": 2,
+    "num_windows": 8,
+    "ceiling_height": "Standard (8ft)",
+    "floor_material": "Hardwood",
+    "additional_requirements": "",
+    "timeline": "Not specified",
+    "priority": "Not specified",
+}
+
+def _design_options(kwargs):
+    """
+    Extract the optional design parameters from kwargs, applying defaults
+    """
+    return {
+        'room_details': kwargs.get('room_details', {}),
+        'num_bedrooms': kwargs.get('num_bedrooms', 3),
+        'num_bathrooms': kwargs.get('num_bathrooms', 2),
+        'num_doors': kwargs.get('num_doors', 2),
+        'num_windows': kwargs.get('num_windows', 8),
+        'ceiling_height': kwargs.get('ceiling_height', 'Standard (8ft)'),
+        'floor_material': kwargs.get('floor_material', 'Hardwood'),
+        'additional_requirements': kwargs.get('additional_requirements', ''),
+        'timeline': kwargs.get('timeline', 'Not specified'),
+        'priority': kwargs.get('priority', 'Not specified'),
+    }
+
+# Static designer instructions, sent once per call as the system instruction
+DESIGNER_INSTRUCTIONS = """
+You are an expert home designer and architect. Create a comprehensive custom home design plan for the specifications the user provides.
+
+Please provide a detailed design plan that includes:
+1. Overall layout and floor plan description
+2. Room-by-room breakdown with dimensions and purposes
+3. Architectural features and design elements
+4. Color scheme recommendations
+5. Material suggestions
+6. Lighting and electrical considerations
+7. Furniture and decor recommendations
+8. Outdoor space planning (if applicable)
+9. Energy efficiency considerations
+10. Estimated timeline and budget considerations
+11. Door and window placement strategy
+12. Storage solutions and organization
+13. Accessibility features
+14. Smart home integration recommendations
+15. Maintenance considerations
+
+Format the response in clear, organized Markdown with headers and bullet points.
+Make it detailed, practical, and tailored to the specified style and requirements.
+Consider the project timeline and priority in your recommendations.
+"""
+
+# Structured plans: the same sections, returned as JSON constrained by PLAN_SCHEMA
+STRUCTURED_DESIGNER_INSTRUCTIONS = DESIGNER_INSTRUCTIONS.replace(
+    "Format the response in clear, organized Markdown with headers and bullet points.",
+    "Return the plan as JSON matching the response schema, one field per section, without Markdown formatting."
+)
+# Passed per call rather than to get_model, as the schema is not hashable for the model registry.
+# Merged into GENERATION_CONFIG by the client, so the output limit must be raised here.
+STRUCTURED_OUTPUT_CONFIG = {"response_mime_type": "application/json", "response_schema": PLAN_SCHEMA,
+                            "max_output_tokens": STRUCTURED_MAX_OUTPUT_TOKENS}
+
+# Sectioned plans: sections are requested and cached individually, so an edit only regenerates what it affects
+SECTION_DESIGNER_INSTRUCTIONS = """
+You are an expert home designer and architect. You write individual sections of a custom home design plan.
+
+Write only the sections the user asks for, from the specifications they provide, as JSON matching the response schema.
+Make them detailed, practical, and tailored to the specified style and requirements, without Markdown formatting.
+"""
+
+# Request inputs in the order and wording used in section prompts
+SECTION_INPUT_LABELS = (
+    ("style", "Style"),
+    ("size", "Size"),
+    ("rooms", "Number of Rooms"),
+    ("num_bedrooms", "Bedrooms"),
+    ("num_bathrooms", "Bathrooms"),
+    ("num_doors", "Exterior Doors"),
+    ("num_windows", "Windows"),
+    ("ceiling_height", "Ceiling Height"),
+    ("floor_material", "Floor Material"),
+    ("room_details", "Room Details"),
+    ("additional_requirements", "Additional Requirements"),
+    ("timeline", "Project Timeline"),
+    ("priority", "Design Priority"),
+)
+
+def build_design_prompt(style, size, rooms, **kwargs):
+    """
+    Build the per-request specification sent to Gemini for a custom home design plan
+    """
+    options = _design_options(kwargs)
     
+    return f"""
     Style: {style}
     Size: {size}
     Number of Rooms: {rooms}
     
     Room Configuration:
-    - Bedrooms: {num_bedrooms}
-    - Bathrooms: {num_bathrooms}
-    - Exterior Doors: {num_doors}
-    - Windows: {num_windows}
-    - Ceiling Height: {ceiling_height}
-    - Floor Material: {floor_material}
+    - Bedrooms: {options['num_bedrooms']}
+    - Bathrooms: {options['num_bathrooms']}
+    - Exterior Doors: {options['num_doors']}
+    - Windows: {options['num_windows']}
+    - Ceiling Height: {options['ceiling_height']}
+    - Floor Material: {options['floor_material']}
     
     Room Details:
-    {format_room_details(room_details)}
+    {format_room_details(options['room_details'])}
     
     Additional Requirements:
-    {additional_requirements}
-    
-    Project Timeline: {timeline}
-    Design Priority: {priority}
-    
-    Please provide a detailed design plan that includes:
-    1. Overall layout and floor plan description
-    2. Room-by-room breakdown with dimensions and purposes
-    3. Architectural features and design elements
-    4. Color scheme recommendations
-    5. Material suggestions
-    6. Lighting and electrical considerations
-    7. Furniture and decor recommendations
-    8. Outdoor space planning (if applicable)
-    9. Energy efficiency considerations
-    10. Estimated timeline and budget considerations
-    11. Door and window placement strategy
-    12. Storage solutions and organization
-    13. Accessibility features
-    14. Smart home integration recommendations
-    15. Maintenance considerations
+    {options['additional_requirements']}
     
-    Format the response in clear, organized Markdown with headers and bullet points.
-    Make it detailed, practical, and tailored to the specified style and requirements.
-    Consider the project timeline and priority in your recommendations.
+    Project Timeline: {options['timeline']}
+    Design Priority: {options['priority']}
     """
-    
+
+def build_section_prompt(fields, inputs):
+    """
+    Build the request for the given plan sections, specifying only the inputs those sections are written from
+    """
+    used = {name for field in fields for name in section_inputs(field)}
+    lines = []
+    for name, label in SECTION_INPUT_LABELS:
+        if name not in used:
+            continue
+        if name == "room_details":
+            lines.append(f"{label}:\n{format_room_details(inputs[name])}")
+        else:
+            lines.append(f"{label}: {inputs[name]}")
+    headings = dict(SECTIONS)
+    requested = "\n".join(f"- {field}: {headings[field]}" for field in fields)
+    return "\n".join(lines) + f"\n\nSections to write:\n{requested}\n"
+
+def _section_inputs(style, size, rooms, kwargs):
+    return dict(_design_options(kwargs), style=style, size=size, rooms=rooms)
+
+def _section_cache_key(model_name, field, inputs):
+    # Depends only on the section's own inputs, so other edits leave it valid
+    used = json.dumps({name: inputs[name] for name in section_inputs(field)}, sort_keys=True, default=str)
+    return hashlib.sha256(f"{model_name}\n{field}\n{used}".encode("utf-8")).hexdigest()
+
+def _get_cached_section(field, key):
+    data = get_cache().get("design_section", key, SECTION_PROMPT_VERSION)
+    if data is None:
+        return None
     try:
-        # Initialize the model
-        model = genai.GenerativeModel(
-            model_name=model_name,
-            generation_config=GENERATION_CONFIG
-        )
-        
-        # Start chat session
-        chat_session = model.start_chat(
-            history=[
-                {
-                    "role": "user",
-                    "parts": [context],
-                }
-            ]
-        )
+        return load_section(field, data)
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable cached {field} section: {e}")
+        return None
+
+def _store_cached_section(field, key, value, ttl=DESIGN_CACHE_TTL):
+    get_cache().set("design_section", key, dump_section(field, value), ttl, SECTION_PROMPT_VERSION)
+
+def _design_cache_key(model_name, context):
+    return hashlib.sha256(f"{model_name}\n{context}".encode("utf-8")).hexdigest()
+
+def _get_cached_design(key):
+    return get_cache().get("design", key, DESIGN_PROMPT_VERSION)
+
+def _store_cached_design(key, text, ttl=DESIGN_CACHE_TTL):
+    get_cache().set("design", key, text, ttl, DESIGN_PROMPT_VERSION)
+
+def _get_cached_plan(key):
+    data = get_cache().get("design_plan", key, PLAN_PROMPT_VERSION)
+    if data is None:
+        return None
+    try:
+        return plan_from_dict(data)
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable cached design plan: {e}")
+        return None
+
+def _store_cached_plan(key, plan, ttl=DESIGN_CACHE_TTL):
+    get_cache().set("design_plan", key, plan.to_dict(), ttl, PLAN_PROMPT_VERSION)
+
+def _find_similar_design(model_name, style, size, rooms, kwargs):
+    # Serve a plan cached for a near-duplicate request, if the semantic cache is enabled
+    if semantic_index is None:
+        return None
+    similar_key = semantic_index.lookup(model_name, style, size, rooms, kwargs)
+    return _get_cached_design(similar_key) if similar_key else None
+
+def _remember_design(model_name, style, size, rooms, kwargs, cache_key, text):
+    _store_cached_design(cache_key, text)
+    if semantic_index is not None:
+        semantic_index.add(model_name, style, size, rooms, kwargs, cache_key)
+
+# One ready GenerativeModel per (model_name, generation_config, system_instruction),
+# shared by every session thread in the process
+_model_registry = {}
+_model_registry_lock = threading.Lock()
+
+def _registry_key(model_name, generation_config, system_instruction):
+    return (model_name, tuple(sorted(generation_config.items())), system_instruction)
+
+def get_model(model_name, generation_config=GENERATION_CONFIG, system_instruction=DESIGNER_INSTRUCTIONS):
+    """
+    Return the shared GenerativeModel for this model and configuration, creating it on first use
+    """
+    key = _registry_key(model_name, generation_config, system_instruction)
+    model = _model_registry.get(key)
+    if model is None:
+        with _model_registry_lock:
+            model = _model_registry.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=generation_config,
+                    system_instruction=system_instruction
+                )
+                _model_registry[key] = model
+    return model
+
+_warmed_models = set()
+
+def warm_model_clients(model_names=WARM_MODELS):
+    """
+    Create the registry entries for model_names and open their API connections
+    with a token-count request, so the first user request does not pay setup cost.
+    Safe to call repeatedly; models already warmed are skipped.
+    """
+    for model_name in model_names:
+        with _model_registry_lock:
+            if model_name in _warmed_models:
+                continue
+            _warmed_models.add(model_name)
+        try:
+            get_model(model_name).count_tokens("warm-up")
+            logger.info(f"Warmed Gemini client for {model_name}")
+        except Exception as e:
+            logger.warning(f"Could not warm Gemini client for {model_name}: {e}")
+
+def _record_usage(model_name, response, started_at):
+    usage = getattr(response, 'usage_metadata', None)
+    record_token_usage(
+        model_name,
+        getattr(usage, 'prompt_token_count', 0) or 0,
+        getattr(usage, 'candidates_token_count', 0) or 0,
+        time.monotonic() - started_at
+    )
+
+def _admit_gemini(context, on_wait, max_output_tokens=GENERATION_CONFIG["max_output_tokens"]):
+    # Wait for a Gemini rate-limit slot; raises AdmissionRejected when none frees up in time
+    tokens = estimate_gemini_tokens(DESIGNER_INSTRUCTIONS + context, max_output_tokens)
+    gemini_limiter.acquire(tokens, on_wait)
+
+def _hit_token_limit(response):
+    # True if Gemini stopped at max_output_tokens, leaving structured output cut off
+    return any(candidate.finish_reason == genai.protos.Candidate.FinishReason.MAX_TOKENS
+               for candidate in response.candidates)
+
+class FallbackDesign(str):
+    """
+    Text served in place of a Gemini plan; reason says why (e.g. "circuit_open", "error")
+    """
+
+    def __new__(cls, text, reason):
+        design = super().__new__(cls, text)
+        design.reason = reason
+        return design
+
+class DesignUnavailable(Exception):
+    """
+    Raised instead of returning a FallbackDesign when the caller passed allow_fallback=False
+    """
+
+    def __init__(self, reason):
+        super().__init__(f"Gemini could not produce a design plan ({reason})")
+        self.reason = reason
+
+def _design_fallback(style, size, rooms, model_name, kwargs, reason):
+    inc("gemini_fallbacks_total", model=model_name, reason=reason)
+    return FallbackDesign(generate_fallback_design(style, size, rooms, **_design_options(kwargs)), reason)
+
+def _empty_design():
+    return FallbackDesign("Unable to generate design. Please try again.", "empty_response")
+
+def _admit_design_call(model_name, context, on_wait, max_output_tokens=GENERATION_CONFIG["max_output_tokens"]):
+    # Circuit breaker first (no waiting when Gemini is failing), then rate-limit admission.
+    # Returns the breaker's CallPermit, or a fallback reason if the call must not go upstream.
+    permit = get_breaker(model_name).allow()
+    if permit is None:
+        logger.warning(f"Gemini circuit for {model_name} is open; serving fallback design")
+        return None, "circuit_open"
+    try:
+        _admit_gemini(context, on_wait, max_output_tokens)
+    except AdmissionRejected as e:
+        permit.release_probe()
+        logger.warning(f"Gemini request not admitted: {e}")
+        return permit, "not_admitted"
+    return permit, None
+
+def _request_design(style, size, rooms, model_name, context, cache_key, on_wait, kwargs):
+    # Call Gemini for a plan that missed the cache, storing successful results
+    permit, rejected = _admit_design_call(model_name, context, on_wait)
+    if rejected:
+        return _design_fallback(style, size, rooms, model_name, kwargs, rejected)
+
+    started_at = time.monotonic()
+    try:
+        model = get_model(model_name)
         
-        # Send message and get response
-        response = chat_session.send_message(context)
+        # Send the specification and get response
+        response = model.generate_content(context)
+        _record_usage(model_name, response, started_at)
         
         # Process the response
         if hasattr(response, 'text'):
-            return response.text
+            text = response.text
         elif hasattr(response, 'parts') and len(response.parts) > 0:
-            return response.parts[0].text
+            text = response.parts[0].text
         else:
-            return "Unable to generate design. Please try again."
+            permit.record(False, time.monotonic() - started_at)
+            return _empty_design()
             
     except Exception as e:
+        permit.record(True, time.monotonic() - started_at)
         logger.error(f"Error generating design: {e}")
-        return generate_fallback_design(style, size, rooms, room_details, num_bedrooms, num_bathrooms, 
-                                      num_doors, num_windows, ceiling_height, floor_material, 
-                                      additional_requirements, timeline, priority)
+        return _design_fallback(style, size, rooms, model_name, kwargs, "error")
+
+    permit.record(False, time.monotonic() - started_at)
+    _remember_design(model_name, style, size, rooms, kwargs, cache_key, text)
+    return text
+
+@profiled
+def generate_design_idea(style, size, rooms, model_name="gemini-1.5-flash", on_wait=None, allow_fallback=True,
+                         **kwargs):
+    """
+    Generate custom home design plan using Google's Gemini AI.
+
+    on_wait(provider, position) is called with the caller's queue position while
+    the request waits for Gemini rate-limit admission. Concurrent identical
+    requests share a single Gemini call. When Gemini cannot be used, a
+    FallbackDesign is returned, or DesignUnavailable raised if allow_fallback
+    is False.
+    """
+    style, size, rooms, kwargs = normalize_design_request(style, size, rooms, **kwargs)
+    context = build_design_prompt(style, size, rooms, **kwargs)
+    cache_key = _design_cache_key(model_name, context)
+    cached = _get_cached_design(cache_key)
+    if cached is None:
+        cached = _find_similar_design(model_name, style, size, rooms, kwargs)
+    if cached is not None:
+        return cached
+    text = _generate_design(style, size, rooms, model_name, context, cache_key, on_wait, kwargs)
+    if isinstance(text, FallbackDesign) and not allow_fallback:
+        raise DesignUnavailable(text.reason)
+    return text
+
+def _generate_design(style, size, rooms, model_name, context, cache_key, on_wait, kwargs):
+    # Ask Gemini for exactly this request, sharing the call with identical in-flight requests
+    def request():
+        return _request_design(style, size, rooms, model_name, context, cache_key, on_wait, kwargs)
+
+    try:
+        return _design_flight.do(cache_key, request)
+    except FlightAbandoned:
+        # The identical stream we were waiting on stopped part-way; generate our own
+        return request()
+
+@profiled
+def stream_design_idea(style, size, rooms, model_name="gemini-1.5-flash", on_wait=None, **kwargs):
+    """
+    Stream a custom home design plan from Google's Gemini AI.
+
+    Yields the accumulated plan text each time a new chunk arrives, so callers
+    can simply re-render the latest value. The last value yielded is the final
+    plan; if the stream fails at any point it is the fallback design instead of
+    a truncated plan. Completed plans share the generate_design_idea cache.
+    on_wait behaves as in generate_design_idea. A request identical to one
+    already in flight waits for that result and yields it once.
+    """
+    style, size, rooms, kwargs = normalize_design_request(style, size, rooms, **kwargs)
+    context = build_design_prompt(style, size, rooms, **kwargs)
+    cache_key = _design_cache_key(model_name, context)
+    cached = _get_cached_design(cache_key)
+    if cached is None:
+        cached = _find_similar_design(model_name, style, size, rooms, kwargs)
+    if cached is not None:
+        yield cached
+        return
+
+    is_leader, call = _design_flight.begin(cache_key)
+    if not is_leader:
+        try:
+            yield call.wait()
+            return
+        except FlightAbandoned:
+            # The identical stream stopped part-way; stream our own without publishing it
+            call = None
+    
+    text = ""
+    final_text = None
+    permit, rejected = _admit_design_call(model_name, context, on_wait)
+    if rejected:
+        final_text = _design_fallback(style, size, rooms, model_name, kwargs, rejected)
+        if call is not None:
+            _design_flight.finish(cache_key, call, result=final_text)
+        yield final_text
+        return
+
+    started_at = time.monotonic()
+    outcome_recorded = False
+    try:
+        model = get_model(model_name)
+        response = model.generate_content(context, stream=True)
+        for chunk in response:
+            if chunk.text:
+                text += chunk.text
+                yield text
+        # Usage metadata is complete once the stream has been consumed
+        _record_usage(model_name, response, started_at)
+        permit.record(False, time.monotonic() - started_at)
+        outcome_recorded = True
+        if text:
+            _remember_design(model_name, style, size, rooms, kwargs, cache_key, text)
+            final_text = text
+        else:
+            final_text = _empty_design()
+            yield final_text
+    except GeneratorExit:
+        # The caller stopped reading (e.g. the session reran); don't publish a partial plan
+        raise
+    except Exception as e:
+        if not outcome_recorded:
+            permit.record(True, time.monotonic() - started_at)
+            outcome_recorded = True
+        logger.error(f"Error streaming design after {len(text)} characters: {e}")
+        final_text = _design_fallback(style, size, rooms, model_name, kwargs, "error")
+        yield final_text
+    finally:
+        if not outcome_recorded:
+            permit.release_probe()
+        if call is not None:
+            if final_text is None:
+                _design_flight.finish(cache_key, call, error=FlightAbandoned(cache_key))
+            else:
+                _design_flight.finish(cache_key, call, result=final_text)
+
+def _request_plan(style, size, rooms, model_name, context, cache_key, on_wait, kwargs):
+    # Call Gemini for a structured plan that missed the cache, storing plans that parse
+    permit, rejected = _admit_design_call(model_name, context, on_wait, STRUCTURED_MAX_OUTPUT_TOKENS)
+    if rejected:
+        return _design_fallback(style, size, rooms, model_name, kwargs, rejected)
+
+    started_at = time.monotonic()
+    try:
+        model = get_model(model_name, system_instruction=STRUCTURED_DESIGNER_INSTRUCTIONS)
+        response = model.generate_content(context, generation_config=STRUCTURED_OUTPUT_CONFIG)
+        _record_usage(model_name, response, started_at)
+        truncated = _hit_token_limit(response)
+        text = None if truncated else response.text
+    except Exception as e:
+        permit.record(True, time.monotonic() - started_at)
+        logger.error(f"Error generating structured design: {e}")
+        return _design_fallback(style, size, rooms, model_name, kwargs, "error")
+    permit.record(False, time.monotonic() - started_at)
+
+    if truncated:
+        logger.warning(f"Structured design plan hit the {STRUCTURED_MAX_OUTPUT_TOKENS}-token output limit; "
+                       f"requesting a Markdown plan instead")
+        inc("structured_plan_fallbacks_total", model=model_name, reason="max_tokens")
+        return generate_design_idea(style, size, rooms, model_name=model_name, on_wait=on_wait, **kwargs)
+    try:
+        plan = parse_plan(text)
+    except ValueError as e:
+        logger.warning(f"Structured design plan did not parse ({e}); requesting a Markdown plan instead")
+        inc("structured_plan_fallbacks_total", model=model_name, reason="invalid")
+        return generate_design_idea(style, size, rooms, model_name=model_name, on_wait=on_wait, **kwargs)
+    _store_cached_plan(cache_key, plan)
+    return plan
+
+@profiled
+def generate_design_plan(style, size, rooms, model_name="gemini-1.5-flash", on_wait=None, **kwargs):
+    """
+    Generate a design plan as a plan.DesignPlan from Gemini's schema-constrained JSON.
+
+    If the response does not parse, the Markdown plan from generate_design_idea
+    is returned instead, and the fallback design string when Gemini is
+    unavailable; plan.plan_markdown renders either. on_wait and request
+    sharing behave as in generate_design_idea.
+    """
+    style, size, rooms, kwargs = normalize_design_request(style, size, rooms, **kwargs)
+    context = build_design_prompt(style, size, rooms, **kwargs)
+    cache_key = _design_cache_key(model_name, context)
+    cached = _get_cached_plan(cache_key)
+    if cached is not None:
+        return cached
+
+    def request():
+        return _request_plan(style, size, rooms, model_name, context, cache_key, on_wait, kwargs)
+
+    try:
+        return _plan_flight.do(cache_key, request)
+    except FlightAbandoned:
+        return request()
+
+def _request_sections(style, size, rooms, model_name, fields, inputs, keys, on_wait, kwargs):
+    # Call Gemini for the sections that missed the cache and store each one.
+    # Returns {field: value}, or a Markdown/fallback plan string for the whole request.
+    context = build_section_prompt(fields, inputs)
+    permit, rejected = _admit_design_call(model_name, context, on_wait, STRUCTURED_MAX_OUTPUT_TOKENS)
+    if rejected:
+        return _design_fallback(style, size, rooms, model_name, kwargs, rejected)
+
+    started_at = time.monotonic()
+    try:
+        model = get_model(model_name, system_instruction=SECTION_DESIGNER_INSTRUCTIONS)
+        response = model.generate_content(
+            context, generation_config={"response_mime_type": "application/json", "response_schema": section_schema(fields),
+                                        "max_output_tokens": STRUCTURED_MAX_OUTPUT_TOKENS}
+        )
+        _record_usage(model_name, response, started_at)
+        truncated = _hit_token_limit(response)
+        text = None if truncated else response.text
+    except Exception as e:
+        permit.record(True, time.monotonic() - started_at)
+        logger.error(f"Error generating design sections {', '.join(fields)}: {e}")
+        return _design_fallback(style, size, rooms, model_name, kwargs, "error")
+    permit.record(False, time.monotonic() - started_at)
+
+    groups = section_groups(fields)
+    if truncated and len(groups) > 1:
+        # Too many sections for one response: ask for them a group at a time, each with its own limit
+        logger.warning(f"Design sections hit the {STRUCTURED_MAX_OUTPUT_TOKENS}-token output limit; "
+                       f"requesting them in {len(groups)} groups")
+        inc("structured_plan_splits_total", model=model_name)
+        sections = {}
+        for group in groups:
+            generated = _request_sections(style, size, rooms, model_name, group, inputs, keys, on_wait, kwargs)
+            if not isinstance(generated, dict):
+                return generated
+            sections.update(generated)
+        return sections
+    if truncated:
+        logger.warning(f"Design sections {', '.join(fields)} hit the {STRUCTURED_MAX_OUTPUT_TOKENS}-token output "
+                       f"limit; requesting a Markdown plan instead")
+        inc("structured_plan_fallbacks_total", model=model_name, reason="max_tokens")
+        return generate_design_idea(style, size, rooms, model_name=model_name, on_wait=on_wait, **kwargs)
+    try:
+        sections = parse_sections(text, fields)
+    except ValueError as e:
+        logger.warning(f"Design sections did not parse ({e}); requesting a Markdown plan instead")
+        inc("structured_plan_fallbacks_total", model=model_name, reason="invalid")
+        return generate_design_idea(style, size, rooms, model_name=model_name, on_wait=on_wait, **kwargs)
+    for field, value in sections.items():
+        _store_cached_section(field, keys[field], value)
+    return sections
+
+def _generate_sections(style, size, rooms, model_name, fields, inputs, keys, on_wait, kwargs):
+    # One shared Gemini call for fields; identical concurrent requests wait for it
+    flight_key = hashlib.sha256("\n".join(keys[field] for field in fields).encode("utf-8")).hexdigest()
+
+    def request():
+        return _request_sections(style, size, rooms, model_name, fields, inputs, keys, on_wait, kwargs)
+
+    try:
+        return _sections_flight.do(flight_key, request)
+    except FlightAbandoned:
+        return request()
+
+@profiled
+def generate_sectioned_plan(style, size, rooms, model_name="gemini-1.5-flash", on_wait=None,
+                            fanout=FANOUT_DESIGN_PLANS, **kwargs):
+    """
+    Generate a plan.DesignPlan section by section, reusing every cached section
+    whose inputs (plan.SECTION_INPUTS) are unchanged.
+
+    The sections an edit affects are requested together in one Gemini call, so
+    changing e.g. only floor_material regenerates the few sections written from
+    it. With fanout, they are instead split by plan.SECTION_GROUPS into
+    concurrent calls, each with its own output token limit. Falls back like
+    generate_design_plan; on_wait and request sharing behave as in
+    generate_design_idea.
+    """
+    style, size, rooms, kwargs = normalize_design_request(style, size, rooms, **kwargs)
+    inputs = _section_inputs(style, size, rooms, kwargs)
+    keys = {field: _section_cache_key(model_name, field, inputs) for field, _ in SECTIONS}
+    sections = {}
+    for field, key in keys.items():
+        value = _get_cached_section(field, key)
+        if value is not None:
+            sections[field] = value
+    stale = [field for field in keys if field not in sections]
+    inc("design_sections_total", len(sections), result="reused")
+    inc("design_sections_total", len(stale), result="generated")
+
+    groups = section_groups(stale) if fanout else [stale] if stale else []
+    args = (style, size, rooms, model_name)
+    if len(groups) > 1:
+        futures = [
+            _fanout_executor.submit(bind_context(_generate_sections), *args, group, inputs, keys, on_wait, kwargs)
+            for group in groups
+        ]
+        results = [future.result() for future in futures]
+    else:
+        results = [_generate_sections(*args, group, inputs, keys, on_wait, kwargs) for group in groups]
+    for generated in results:
+        # A group that could not be generated turns the whole plan into its fallback
+        if not isinstance(generated, dict):
+            return generated
+        sections.update(generated)
+    return DesignPlan(f"{style} Home Design Plan", **sections)
+
+def plan_generator():
+    """
+    Return the blocking plan generator the configuration selects
+    """
+    if SECTIONED_DESIGN_PLANS or FANOUT_DESIGN_PLANS:
+        return generate_sectioned_plan
+    if STRUCTURED_DESIGN_PLANS:
+        return generate_design_plan
+    return generate_design_idea
+
+def warm_design(style, size, rooms, model_name="gemini-1.5-flash", ttl=DESIGN_CACHE_TTL, **kwargs):
+    """
+    Make sure the plan for a request is cached for at least ttl seconds, in the
+    cache the app reads (Markdown plans, structured plans or sections; see plan_generator).
+
+    Returns "cached" if the plan was already cached, "generated" if Gemini was
+    called, or "failed" if only a fallback design could be produced (fallbacks
+    are never cached). Similar cached plans are not used: the semantic index
+    serves visitors, but warming stores a plan for this exact request.
+    """
+    style, size, rooms, kwargs = normalize_design_request(style, size, rooms, **kwargs)
+    generate = plan_generator()
+    # Plans are re-stored so one generated at night is still fresh for the next day's visitors
+    if generate is generate_sectioned_plan:
+        inputs = _section_inputs(style, size, rooms, kwargs)
+        keys = {field: _section_cache_key(model_name, field, inputs) for field, _ in SECTIONS}
+        cached = all(_get_cached_section(field, key) is not None for field, key in keys.items())
+        plan = generate_sectioned_plan(style, size, rooms, model_name=model_name, **kwargs)
+        if not isinstance(plan, DesignPlan):
+            return "failed"
+        for field, key in keys.items():
+            _store_cached_section(field, key, getattr(plan, field), ttl)
+        return "cached" if cached else "generated"
+
+    context = build_design_prompt(style, size, rooms, **kwargs)
+    cache_key = _design_cache_key(model_name, context)
+    if generate is generate_design_plan:
+        plan = _get_cached_plan(cache_key)
+        status = "cached"
+        if plan is None:
+            plan = generate_design_plan(style, size, rooms, model_name=model_name, **kwargs)
+            status = "generated"
+        # A Markdown plan means the structured one could not be produced
+        if not isinstance(plan, DesignPlan):
+            return "failed"
+        _store_cached_plan(cache_key, plan, ttl)
+        return status
+
+    text = _get_cached_design(cache_key)
+    status = "cached"
+    if text is None:
+        text = _generate_design(style, size, rooms, model_name, context, cache_key, None, kwargs)
+        status = "generated"
+    if isinstance(text, FallbackDesign):
+        return "failed"
+    _store_cached_design(cache_key, text, ttl)
+    return status
 
 def format_room_details(room_details):
     """
@@ -125,6 +770,19 @@ def format_room_details(room_details):
         formatted_details.append(room_info)
     return "\n".join(formatted_details)
 
+# Changes to the instructions or prompt wording invalidate previously cached plans
+DESIGN_PROMPT_VERSION = template_version(DESIGNER_INSTRUCTIONS + build_design_prompt("{style}", "{size}", "{rooms}"))
+# Structured plans and sections are also invalidated by schema changes
+PLAN_PROMPT_VERSION = template_version(
+    STRUCTURED_DESIGNER_INSTRUCTIONS + json.dumps(PLAN_SCHEMA, sort_keys=True)
+    + build_design_prompt("{style}", "{size}", "{rooms}")
+)
+SECTION_PROMPT_VERSION = template_version(
+    SECTION_DESIGNER_INSTRUCTIONS + json.dumps(PLAN_SCHEMA, sort_keys=True)
+    + build_section_prompt([field for field, _ in SECTIONS],
+                           dict({name: f"{{{name}}}" for name, _ in SECTION_INPUT_LABELS}, room_details={}))
+)
+
 def generate_fallback_design(style, size, rooms, room_details, num_bedrooms, num_bathrooms, 
                            num_doors, num_windows, ceiling_height, floor_material, 
                            additional_requirements, timeline, priority):
@@ -202,32 +860,57 @@ Neutral palette with shades of gray, white, and beige. Accent colors like deep b
 This design plan provides a starting point; further customization and professional consultation are recommended.
 """
 
-@st.cache_data(ttl=86400)  # Cache for 24 hours
-@retry(wait=wait_exponential(multiplier=1, min=4, max=10), stop=stop_after_attempt(3), after=after_log(logger, logging.WARNING))
+LEXICA_QUERY_TEMPLATE = "{style} home design architecture interior"
+
+@profiled
 def fetch_image_from_lexica(style):
     """
     Fetch relevant images from Lexica.art based on design style
     """
+    results = fetch_lexica_results(style)
+    return results[0]["src"] if results else None
+
+def fetch_lexica_results(style):
+    """
+    Return every Lexica.art result for a design style as a list of
+    {"src", "thumbnail", "prompt"} dicts. The full list is cached per
+    normalized style, so paging through it needs no further Lexica requests.
+    """
+    return _fetch_lexica_results(normalize_style(style)) or []
+
+@persistent_cache("lexica", ttl=IMAGE_CACHE_TTL, version=template_version(LEXICA_QUERY_TEMPLATE) + "-results")
+@_instrumented("lexica")
+def _fetch_lexica_results(style):
     try:
         # Prepare search query
-        search_query = f"{style} home design architecture interior"
+        search_query = LEXICA_QUERY_TEMPLATE.format(style=style)
         
         # Construct API URL
         params = {
             "q": search_query,
-            "limit": 10
+            "limit": LEXICA_RESULT_LIMIT
         }
         
         # Make API request
-        response = requests.get(LEXICA_BASE_URL, params=params, timeout=10)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        # Retried with jitter and hedged when slow, all within LEXICA_DEADLINE
+        response = request_with_deadline(
+            "GET", LEXICA_BASE_URL, LEXICA_DEADLINE, hedge_after=LEXICA_HEDGE_AFTER, params=params
+        )
         
         # Parse response
         data = response.json()
         
-        # Return first image URL if available
+        # Keep every result; callers page through them
         if data.get("images") and len(data["images"]) > 0:
-            return data["images"][0]["src"]
+            return [
+                {
+                    "src": image["src"],
+                    "thumbnail": image.get("srcSmall") or image["src"],
+                    "prompt": image.get("prompt", ""),
+                }
+                for image in data["images"][:LEXICA_RESULT_LIMIT]
+                if image.get("src")
+            ]
         else:
             logger.warning(f"No images found for style: {style}")
             return None
@@ -239,6 +922,59 @@ def fetch_image_from_lexica(style):
         logger.error(f"Unexpected error fetching image: {e}")
         return None
 
+def is_image(data):
+    """
+    True if data is an image Pillow can decode
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+def fetch_thumbnail(url):
+    """
+    Download an image once into the blob store and return its reference, or None
+    """
+    thumbnail_ref = _fetch_thumbnail(url)
+    if is_blob_ref(thumbnail_ref) and not blob_store.exists(thumbnail_ref):
+        # The blob was evicted while its cache entry lived on
+        get_cache().delete("lexica_thumbnail", make_key(url))
+        thumbnail_ref = _fetch_thumbnail(url)
+    return thumbnail_ref
+
+@persistent_cache("lexica_thumbnail", ttl=IMAGE_CACHE_TTL)
+@_instrumented("lexica_thumbnail")
+def _fetch_thumbnail(url):
+    try:
+        response = request_with_deadline("GET", url, LEXICA_DEADLINE, hedge_after=LEXICA_HEDGE_AFTER)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Could not download thumbnail {url}: {e}")
+        return None
+    if not is_image(response.content):
+        logger.warning(f"Thumbnail {url} is not an image ({response.headers.get('Content-Type')})")
+        return None
+    return blob_store.put(response.content)
+
+@profiled
+def get_gallery_page(style, page, page_size=GALLERY_PAGE_SIZE):
+    """
+    Return (items, page_count) for one page of the Lexica gallery. Each item is a
+    result dict with a "thumbnail_ref" blob reference (None if the download failed).
+    Thumbnails for the following page are prefetched in the background.
+    """
+    results = fetch_lexica_results(style)
+    page_count = max(1, -(-len(results) // page_size))
+    start = page * page_size
+    items = [dict(result) for result in results[start:start + page_size]]
+    for item, thumbnail_ref in zip(items, _background_executor.map(fetch_thumbnail, [i["thumbnail"] for i in items])):
+        item["thumbnail_ref"] = thumbnail_ref
+    for result in results[start + page_size:start + 2 * page_size]:
+        submit_background(fetch_thumbnail, result["thumbnail"])
+    return items, page_count
+
+@profiled
 def validate_inputs(style, size, rooms):
     """
     Validate user inputs
@@ -263,31 +999,59 @@ def validate_inputs(style, size, rooms):
     
     return errors 
 
-@st.cache_data(ttl=86400) # Cache for 24 hours
-def generate_stability_image(style, size, rooms):
+def build_stability_prompt(style, size, rooms):
     """
-    Generate an image using Stability AI API based on a detailed text prompt.
+    Build the Stability AI text prompt for a floor plan image
     """
-    if not STABILITY_AI_API_KEY:
-        logger.error("Stability AI API key is not set.")
-        return None
-
-    # Construct a detailed prompt for Stability AI
     # This prompt is crucial for generating relevant images.
-    prompt = f"""a detailed architectural floor plan and layout of a {style} style home, {size} with {rooms} rooms, 
+    return f"""a detailed architectural floor plan and layout of a {style} style home, {size} with {rooms} rooms, 
     technical blueprint style, showing room layouts, dimensions, and furniture placement, 
     professional architectural drawing, clean lines, precise measurements, 
     includes living areas, bedrooms, bathrooms, kitchen layout, 
     high resolution, technical drawing style, architectural plan view, 
     professional CAD-like rendering, with room labels and measurements"""
+
+# on_wait of the generate_stability_image call on this thread; kept out of the cached function's arguments
+_stability_on_wait = contextvars.ContextVar("stability_on_wait", default=None)
+
+@profiled
+def generate_stability_image(style, size, rooms, on_wait=None):
+    """
+    Generate an image using Stability AI API based on a detailed text prompt.
+
+    Returns a blob store reference ("blob:<sha256>") for the PNG bytes, or None.
+    on_wait is reported the queue position while the request waits for
+    Stability rate-limit admission, as in generate_design_idea.
+    """
+    args = (normalize_style(style), normalize_size(size), normalize_rooms(rooms))
+    token = _stability_on_wait.set(on_wait)
+    try:
+        image_ref = _generate_stability_image(*args)
+        if is_blob_ref(image_ref) and not blob_store.exists(image_ref):
+            # The cache entry outlived its blob (e.g. the blob directory was cleared)
+            get_cache().delete("stability", make_key(*args))
+            image_ref = _generate_stability_image(*args)
+    finally:
+        _stability_on_wait.reset(token)
+    return image_ref
+
+@persistent_cache("stability", ttl=IMAGE_CACHE_TTL,
+                  version=template_version(build_stability_prompt("{style}", "{size}", "{rooms}")) + "-blob")
+@_instrumented("stability")
+def _generate_stability_image(style, size, rooms):
+    if not STABILITY_AI_API_KEY:
+        logger.error("Stability AI API key is not set.")
+        return None
+
+    # Construct a detailed prompt for Stability AI
+    prompt = build_stability_prompt(style, size, rooms)
     
     # Stability AI API endpoint and model (using stable-diffusion-v1-6 or similar)
     # It's important to use the correct API endpoint and parameters based on Stability AI documentation.
     # For text-to-image, a common endpoint might be /v1/generation/{engine_id}/text-to-image
     # I'll use a placeholder for engine_id and then use web_search to confirm the details.
     engine_id = "stable-diffusion-v1-6" # Example engine ID
-    api_host = "https://api.stability.ai"
-    api_url = f"{api_host}/v1/generation/{engine_id}/text-to-image"
+    api_url = f"{STABILITY_API_HOST}/v1/generation/{engine_id}/text-to-image"
 
     headers = {
         "Content-Type": "application/json",
@@ -309,29 +1073,45 @@ def generate_stability_image(style, size, rooms):
         "steps": 30,
     }
 
+    on_wait = _stability_on_wait.get()
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        # Retried with jitter within STABILITY_DEADLINE; raises HTTPError for other bad responses.
+        # Every attempt counts against the Stability quota (retries after a 429 too), so each waits for a slot.
+        response = request_with_deadline(
+            "POST", api_url, STABILITY_DEADLINE, hedge_after=STABILITY_HEDGE_AFTER,
+            before_attempt=lambda: stability_limiter.acquire(on_wait=on_wait),
+            headers=headers, json=payload
+        )
         
         response_data = response.json()
         
-        # Stability AI typically returns base64 encoded images. We need to decode and return as data URL or save.
-        # For Streamlit st.image, a base64 data URL is usually acceptable.
+        # Stability AI returns base64 encoded images. Decode once and keep the bytes in the
+        # blob store, so caches and sessions only hold a short reference.
         if response_data and response_data.get("artifacts"):
             for i, artifact in enumerate(response_data["artifacts"]):
                 if artifact["finishReason"] == "SUCCESS" and artifact["base64"]:
-                    # Return the first successful image as a data URL
-                    base64_data = artifact["base64"]
-                    return f"data:image/png;base64,{base64_data}"
+                    # Return the first successful image
+                    return blob_store.put(base64.b64decode(artifact["base64"]))
             logger.warning("No successful image artifact found from Stability AI.")
             return None
         else:
             logger.warning("No image data received from Stability AI.")
             return None
 
+    except AdmissionRejected as e:
+        logger.warning(f"Stability AI request not admitted: {e}")
+        return None
     except requests.exceptions.RequestException as e:
         logger.error(f"Network or HTTP error generating image from Stability AI: {e}")
         return None
     except Exception as e:
         logger.error(f"Unexpected error generating image from Stability AI: {e}")
-        return None 
\ No newline at end of file
+        return None 
+
+# Image fetchers by source name, shared by the batch tool and design variants.
+# Each takes a request spec and returns an image reference, or None.
+IMAGE_SOURCES = {
+    "none": None,
+    "stability": lambda spec: generate_stability_image(spec["style"], spec["size"], spec["rooms"]),
+    "lexica": lambda spec: fetch_image_from_lexica(spec["style"]),
+}
@@ -0,0 +1,59 @@
+import logging
+
+from config import MAX_DESIGN_VARIANTS
+from utils import IMAGE_SOURCES, submit_background
+
+logger = logging.getLogger(__name__)
+
+# Request fields a comparison can vary, with their form labels
+VARIED_FIELDS = {"style": "Design Style", "priority": "Design Priority"}
+
+
+def variant_specs(style, size, rooms, vary, values, **kwargs):
+    """
+    One spec per value of the varied field ("style" or "priority"), otherwise
+    identical to the request. Each spec is labelled with its value; blank and
+    repeated values are dropped and at most MAX_DESIGN_VARIANTS are kept.
+    """
+    if vary not in VARIED_FIELDS:
+        raise ValueError(f"Cannot vary {vary!r}; choose one of {', '.join(VARIED_FIELDS)}")
+    specs = []
+    seen = set()
+    for value in values:
+        value = " ".join(str(value).split())
+        if not value or value.casefold() in seen:
+            continue
+        seen.add(value.casefold())
+        spec = dict(kwargs, style=style, size=size, rooms=rooms)
+        spec[vary] = value
+        spec["label"] = value
+        specs.append(spec)
+    if len(specs) > MAX_DESIGN_VARIANTS:
+        logger.info(f"Comparing the first {MAX_DESIGN_VARIANTS} of {len(specs)} variants")
+    return specs[:MAX_DESIGN_VARIANTS]
+
+
+def start_variants(specs, generate_plan, image_source="stability"):
+    """
+    Submit every variant's plan and image to the background pool at once, so K
+    variants take about as long as the slowest one. Variants needing the same
+    image (e.g. priority variants) share one image task. Each variant is an
+    ordinary request and is cached under its own keys.
+
+    Returns one (plan_future, image_future) per spec; image_future is None when
+    image_source is "none".
+    """
+    image_fn = IMAGE_SOURCES[image_source]
+    image_futures = {}
+    started = []
+    for spec in specs:
+        request = {key: value for key, value in spec.items() if key != "label"}
+        plan_future = submit_background(generate_plan, **request)
+        image_future = None
+        if image_fn is not None:
+            image_key = (spec["style"],) if image_source == "lexica" else (spec["style"], spec["size"], spec["rooms"])
+            image_future = image_futures.get(image_key)
+            if image_future is None:
+                image_future = image_futures[image_key] = submit_background(image_fn, request)
+        started.append((plan_future, image_future))
+    return started
@@ -0,0 +1,209 @@
+import argparse
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import product
+
+from config import (
+    REQUEST_LOG_PATH,
+    WARM_COMBINATIONS_PER_MIN,
+    WARM_DESIGN_TTL,
+    WARM_IMAGE_SOURCES,
+    WARM_LOOKBACK_DAYS,
+    WARM_QUIET_HOURS,
+    WARM_ROOMS,
+    WARM_SIZES,
+    WARM_STYLES,
+    WARM_TOP_N,
+)
+from normalize import normalize_design_request, read_request_log
+from utils import FORM_DEFAULTS, fetch_lexica_results, generate_stability_image, warm_design
+
+logger = logging.getLogger(__name__)
+
+# Each image source warms the cache behind the matching app option; keyed on what the cache key depends on
+IMAGE_WARMERS = {
+    "stability": (lambda style, size, rooms: (style, size, rooms), generate_stability_image),
+    "lexica": (lambda style, size, rooms: style, lambda style, size, rooms: fetch_lexica_results(style)),
+}
+
+
+def _combination_key(combination):
+    return json.dumps(combination, sort_keys=True, default=str)
+
+
+def popular_combinations(records, top_n, since=None):
+    """
+    Return the top_n most requested normalized (style, size, rooms, kwargs)
+    combinations in records, most popular first. Records older than since
+    (a Unix timestamp) are ignored.
+    """
+    counts = Counter()
+    combinations = {}
+    for record in records:
+        if since is not None and record.get("ts", 0) < since:
+            continue
+        combination = normalize_design_request(
+            record["style"], record["size"], record["rooms"], **record.get("kwargs", {})
+        )
+        key = _combination_key(combination)
+        counts[key] += 1
+        combinations.setdefault(key, combination)
+    return [combinations[key] for key, _ in counts.most_common(top_n)]
+
+
+def configured_combinations(styles=WARM_STYLES, sizes=WARM_SIZES, rooms=WARM_ROOMS):
+    """
+    Normalized combinations of the configured styles, sizes and room counts with
+    the app's default form values, every style at the first size before the next size
+    """
+    return [
+        normalize_design_request(style, size, room_count, **FORM_DEFAULTS)
+        for size, room_count, style in product(sizes, rooms, styles)
+    ]
+
+
+def select_combinations(log_path=REQUEST_LOG_PATH, top_n=WARM_TOP_N, lookback_days=WARM_LOOKBACK_DAYS):
+    """
+    Pick the combinations to warm: the most popular ones in recent traffic,
+    topped up from configuration when the log is missing or too short
+    """
+    selected = []
+    if log_path and os.path.exists(log_path):
+        since = time.time() - lookback_days * 86400
+        selected = popular_combinations(read_request_log(log_path), top_n, since)
+        logger.info(f"Found {len(selected)} popular combinations in {log_path}")
+    seen = {_combination_key(combination) for combination in selected}
+    for combination in configured_combinations():
+        if len(selected) >= top_n:
+            break
+        if _combination_key(combination) not in seen:
+            seen.add(_combination_key(combination))
+            selected.append(combination)
+    return selected
+
+
+def parse_quiet_hours(spec):
+    """
+    Parse "start-end" local hours, e.g. "2-6" or "23-5" (wrapping past midnight)
+    """
+    start, end = (int(part) for part in spec.split("-"))
+    if not (0 <= start < 24 and 0 <= end < 24) or start == end:
+        raise ValueError(f"Invalid quiet hours {spec!r}; expected e.g. '2-6'")
+    return start, end
+
+
+def in_quiet_hours(now, quiet_hours):
+    start, end = quiet_hours
+    if start < end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+def quiet_window_end(now, quiet_hours):
+    """
+    End of the quiet window containing now
+    """
+    end = now.replace(hour=quiet_hours[1], minute=0, second=0, microsecond=0)
+    return end if end > now else end + timedelta(days=1)
+
+
+def next_quiet_window_start(now, quiet_hours):
+    start = now.replace(hour=quiet_hours[0], minute=0, second=0, microsecond=0)
+    return start if start > now else start + timedelta(days=1)
+
+
+def warm(combinations, image_sources=WARM_IMAGE_SOURCES, per_min=WARM_COMBINATIONS_PER_MIN,
+         stop_at=None, design_ttl=WARM_DESIGN_TTL):
+    """
+    Fill the design and image caches for each combination in order, starting at
+    most per_min combinations a minute. Stops early once stop_at (a datetime)
+    has passed. Returns a summary dict of design statuses and images warmed.
+
+    The warmer runs in its own process, so the app's rate limiters do not see
+    its calls; per_min is what keeps it within the providers' quotas.
+    """
+    interval = 60.0 / per_min if per_min > 0 else 0.0
+    statuses = Counter()
+    images = Counter()
+    warmed_images = set()
+    for index, (style, size, rooms, kwargs) in enumerate(combinations):
+        if stop_at is not None and datetime.now() >= stop_at:
+            logger.info(f"Quiet hours are over; stopping after {index} of {len(combinations)} combinations")
+            break
+        started_at = time.monotonic()
+        try:
+            status = warm_design(style, size, rooms, ttl=design_ttl, **kwargs)
+        except Exception as e:
+            logger.error(f"Could not warm design for {style}, {size}, {rooms} rooms: {e}")
+            status = "failed"
+        statuses[status] += 1
+        for source in image_sources:
+            image_key, warm_image = IMAGE_WARMERS[source]
+            key = (source, image_key(style, size, rooms))
+            if key in warmed_images:
+                continue
+            warmed_images.add(key)
+            try:
+                images[source if warm_image(style, size, rooms) else f"{source}_failed"] += 1
+            except Exception as e:
+                logger.error(f"Could not warm {source} image for {style}, {size}, {rooms} rooms: {e}")
+                images[f"{source}_failed"] += 1
+        logger.info(f"Warmed {index + 1}/{len(combinations)}: {style}, {size}, {rooms} rooms ({status})")
+        # Space out upstream calls; the last combination needs no pause
+        if index + 1 < len(combinations):
+            time.sleep(max(0.0, interval - (time.monotonic() - started_at)))
+    return {"designs": dict(statuses), "images": dict(images)}
+
+
+def _run_once(args, quiet_hours):
+    now = datetime.now()
+    stop_at = None
+    if not args.now:
+        if not in_quiet_hours(now, quiet_hours):
+            logger.info(f"Outside quiet hours ({args.quiet_hours}); nothing to do")
+            return None
+        stop_at = quiet_window_end(now, quiet_hours)
+    combinations = select_combinations(args.log, args.top)
+    return warm(combinations, args.images, args.rate, stop_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-generate designs and images for popular requests during quiet hours"
+    )
+    parser.add_argument("--log", default=REQUEST_LOG_PATH, help="JSONL request log (defaults to REQUEST_LOG_PATH)")
+    parser.add_argument("--top", type=int, default=WARM_TOP_N, help="number of combinations to warm")
+    parser.add_argument("--rate", type=float, default=WARM_COMBINATIONS_PER_MIN, help="combinations started per minute")
+    parser.add_argument("--images", nargs="*", choices=sorted(IMAGE_WARMERS), default=WARM_IMAGE_SOURCES,
+                        help="image caches to warm")
+    parser.add_argument("--quiet-hours", default=WARM_QUIET_HOURS, help="local hours when warming may run, e.g. 2-6")
+    parser.add_argument("--now", action="store_true", help="run immediately and ignore quiet hours")
+    parser.add_argument("--loop", action="store_true", help="keep running and warm once every quiet window")
+    parser.add_argument("--dry-run", action="store_true", help="print the combinations that would be warmed")
+    args = parser.parse_args()
+    quiet_hours = parse_quiet_hours(args.quiet_hours)
+
+    if args.dry_run:
+        for style, size, rooms, kwargs in select_combinations(args.log, args.top):
+            print(f"{style} | {size} | {rooms} rooms | {json.dumps(kwargs, sort_keys=True)}")
+        return
+
+    while True:
+        summary = _run_once(args, quiet_hours)
+        if summary is not None:
+            print(f"Designs: {summary['designs']}")
+            print(f"Images:  {summary['images']}")
+        if not args.loop:
+            return
+        args.now = False
+        start = next_quiet_window_start(datetime.now(), quiet_hours)
+        logger.info(f"Next warm-up at {start:%Y-%m-%d %H:%M}")
+        time.sleep(max(0.0, (start - datetime.now()).total_seconds()) + 1)
+
+
+if __name__ == "__main__":
+    main()